@@ -0,0 +1,225 @@
+import argparse
+import heapq
+import json
+import os
+import shutil
+import time
+import numpy as np
+import networkx as nx
+from scipy.sparse.csgraph import connected_components, dijkstra
+from road_network import ROAD_CACHE_DIR, ROAD_WEIGHT, load_road_network
+
+
+ALT_LANDMARKS = int(os.getenv("ALT_LANDMARKS", 16))
+ALT_ARRAYS = ["landmarks", "from_landmarks", "to_landmarks"]
+
+
+def select_landmarks(network, n_landmarks=ALT_LANDMARKS, seed=0):
+    """
+    Farthest-point landmark selection: each new landmark is the node farthest (by road)
+    from the ones chosen so far; nodes no landmark reaches yet are taken first, so every
+    connected component gets one.
+    """
+    rng = np.random.default_rng(seed)
+    landmarks = [int(rng.integers(network.n_nodes))]
+    # Start from the node farthest from a random one, as in the standard heuristic
+    distances = dijkstra(network.graph, directed=False, indices=landmarks[0])
+    finite = np.isfinite(distances)
+    landmarks[0] = int(np.argmax(np.where(finite, distances, -1)))
+    nearest = dijkstra(network.graph, directed=False, indices=landmarks[0])
+    while len(landmarks) < min(n_landmarks, network.n_nodes):
+        unreached = np.flatnonzero(~np.isfinite(nearest))
+        candidate = int(unreached[0]) if len(unreached) else int(np.argmax(nearest))
+        if candidate in landmarks:
+            break
+        landmarks.append(candidate)
+        nearest = np.minimum(nearest, dijkstra(network.graph, directed=False, indices=candidate))
+    return np.array(landmarks, dtype=np.int64)
+
+
+class ALTIndex:
+    """
+    A* with landmarks and the triangle inequality (ALT) over a RoadNetwork.
+
+    `from_landmarks[v, i]` is d(landmark_i, v) and `to_landmarks[v, i]` is d(v, landmark_i),
+    so for any target t the bound max_i(d(L_i, t) - d(L_i, v), d(v, L_i) - d(t, L_i)) never
+    overestimates d(v, t) and steers the search straight towards t.
+    """
+
+    def __init__(self, network, landmarks, from_landmarks, to_landmarks):
+        self.network = network
+        self.landmarks = landmarks
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+        # Plain arrays: element access on memmaps is slow in the search loop
+        self._indptr = np.asarray(network.indptr)
+        self._indices = np.asarray(network.indices)
+        self._weights = np.asarray(network.weights)
+
+    @classmethod
+    def build(cls, network, n_landmarks=ALT_LANDMARKS, seed=0):
+        landmarks = select_landmarks(network, n_landmarks, seed)
+        from_landmarks = dijkstra(network.graph, directed=True, indices=landmarks).T.copy()
+        to_landmarks = dijkstra(network.graph.T.tocsr(), directed=True, indices=landmarks).T.copy()
+        return cls(network, landmarks, from_landmarks, to_landmarks)
+
+    def save(self, path):
+        tmp_dir = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in ALT_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_landmarks": len(self.landmarks), "n_nodes": self.network.n_nodes}, f)
+        try:
+            os.replace(tmp_dir, path)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, network, path):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ALT_ARRAYS}
+        return cls(network, **arrays)
+
+    def _heuristic(self, nodes, target_from, target_to):
+        with np.errstate(invalid="ignore"):
+            bounds = np.fmax(target_from - self.from_landmarks[nodes], self.to_landmarks[nodes] - target_to)
+        # fmax skips the NaNs of landmarks that reach neither node
+        return np.fmax.reduce(bounds, axis=-1, initial=0.0)
+
+    def query(self, source, target):
+        """
+        Shortest path between two node indices.
+
+        Returns:
+            (distance, path) with path a list of node indices, or (inf, None) if unreachable
+        """
+        source, target = int(source), int(target)
+        if source == target:
+            return 0.0, [source]
+        target_from = np.asarray(self.from_landmarks[target])
+        target_to = np.asarray(self.to_landmarks[target])
+        if not np.isfinite(self._heuristic([source], target_from, target_to)[0]):
+            return np.inf, None
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        distance = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        # Ties on f go to the deeper node (larger g), which matters on grid-like networks
+        heap = [(0.0, -0.0, source)]
+        while heap:
+            _, g, u = heapq.heappop(heap)
+            g = -g
+            if u == target:
+                path = [u]
+                while parent[path[-1]] >= 0:
+                    path.append(parent[path[-1]])
+                return g, path[::-1]
+            if u in closed:
+                continue
+            closed.add(u)
+            start, end = indptr[u], indptr[u + 1]
+            improved, costs = [], []
+            for v, weight in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                g_v = g + weight
+                if g_v < distance.get(v, np.inf):
+                    distance[v] = g_v
+                    parent[v] = u
+                    improved.append(v)
+                    costs.append(g_v)
+            if not improved:
+                continue
+            bounds = self._heuristic(improved, target_from, target_to).tolist()
+            for v, g_v, h in zip(improved, costs, bounds):
+                if h != np.inf:
+                    heapq.heappush(heap, (g_v + h, -g_v, v))
+        return np.inf, None
+
+    def route(self, lon1, lat1, lon2, lat2):
+        """Snap two coordinates to the road network and return (distance, [(lon, lat), ...])."""
+        source, target = self.network.nearest_nodes([lon1, lon2], [lat1, lat2])
+        distance, path = self.query(source, target)
+        return distance, (self.network.coordinates(path) if path else None)
+
+
+def load_alt_index(network, n_landmarks=ALT_LANDMARKS):
+    """ALT index for `network`, built once and persisted next to its cached CSR arrays."""
+    path = os.path.join(network.path, f"alt-{n_landmarks}") if network.path else None
+    if path and os.path.exists(os.path.join(path, "meta.json")):
+        print(f"✅ ALT landmarks from cache {path}")
+        return ALTIndex.load(network, path)
+    start = time.perf_counter()
+    index = ALTIndex.build(network, n_landmarks)
+    print(f"✅ Built {len(index.landmarks)} ALT landmarks in {time.perf_counter() - start:.2f} s")
+    if path:
+        index.save(path)
+    return index
+
+
+def to_networkx(network):
+    G = nx.DiGraph()
+    G.add_nodes_from(range(network.n_nodes))
+    sources = np.repeat(np.arange(network.n_nodes), np.diff(network.indptr))
+    G.add_weighted_edges_from(zip(sources.tolist(), np.asarray(network.indices).tolist(),
+                                  np.asarray(network.weights).tolist()))
+    return G
+
+
+def benchmark(network, index, n_queries=100, seed=1):
+    """Time random point-to-point queries with ALT against nx.shortest_path and check the distances agree."""
+    rng = np.random.default_rng(seed)
+    # Pairs within one component, so no query is answered by the unreachability check alone
+    _, labels = connected_components(network.graph, directed=True, connection='strong')
+    sources = rng.integers(network.n_nodes, size=n_queries)
+    members = {label: np.flatnonzero(labels == label) for label in np.unique(labels[sources])}
+    pairs = [(s, rng.choice(members[labels[s]])) for s in sources]
+    G = to_networkx(network)
+    start = time.perf_counter()
+    alt = [index.query(s, t)[0] for s, t in pairs]
+    alt_time = time.perf_counter() - start
+    reference = []
+    start = time.perf_counter()
+    for s, t in pairs:
+        try:
+            path = nx.shortest_path(G, int(s), int(t), weight='weight')
+            reference.append(nx.path_weight(G, path, 'weight'))
+        except nx.NetworkXNoPath:
+            reference.append(np.inf)
+    nx_time = time.perf_counter() - start
+    agree = np.allclose(alt, reference)
+    print(f"{n_queries} queries on {network.n_nodes} nodes: ALT {alt_time / n_queries * 1000:.2f} ms/query, "
+          f"networkx {nx_time / n_queries * 1000:.2f} ms/query ({nx_time / alt_time:.1f}x), distances agree: {agree}")
+    return alt_time, nx_time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build ALT landmarks for a road network and run point-to-point queries")
+    parser.add_argument("road_network", help="Local road network (.graphml, .osm or .osm.pbf)")
+    parser.add_argument("--road-cache-dir", default=ROAD_CACHE_DIR)
+    parser.add_argument("--road-weight", default=ROAD_WEIGHT)
+    parser.add_argument("--landmarks", type=int, default=ALT_LANDMARKS)
+    parser.add_argument("--source", metavar="LON,LAT",
+                        help="Route start (use --source=LON,LAT for negative longitudes)")
+    parser.add_argument("--target", metavar="LON,LAT", help="Route end")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="Compare N random queries with networkx")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    network = load_road_network(args.road_network, args.road_cache_dir, args.road_weight)
+    index = load_alt_index(network, args.landmarks)
+    if args.source and args.target:
+        (lon1, lat1), (lon2, lat2) = [map(float, point.split(",")) for point in (args.source, args.target)]
+        start = time.perf_counter()
+        distance, coords = index.route(lon1, lat1, lon2, lat2)
+        elapsed = (time.perf_counter() - start) * 1000
+        if coords is None:
+            print(f"❌ No route found ({elapsed:.1f} ms)")
+        else:
+            print(f"✅ Route: {distance:.0f} {args.road_weight}, {len(coords)} nodes ({elapsed:.1f} ms)")
+    if args.benchmark:
+        benchmark(network, index, args.benchmark)
+
+
+if __name__ == '__main__':
+    main()
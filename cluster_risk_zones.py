@@ -91,11 +91,21 @@
 
 
 
+import os
+import argparse
+import joblib
 import pandas as pd
 import geopandas as gpd
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 import numpy as np
+import time
+from resource_allocation import ALLOCATION_METHODS, DEFAULT_RESOURCES, allocate
+from risk_model import (CLUSTER_FEATURES, MODEL_DIR, PRENORMALIZED_FEATURES, RISK_LEVELS, RiskModel,
+                        load_risk_model, risk_features, save_risk_model)
+from running_stats import STATS_DECAY, STATS_DIR, RunningStats
+from weather_history import HISTORY_DIR, HISTORY_FEATURES, WeatherHistory, add_history_features
+from weather_grid import compass_directions, destination_points
 
 
 def load_weather_data(file_path):
@@ -107,22 +117,74 @@ def load_weather_data(file_path):
         return None
 
 
-def compute_composite_risk_score(df):
-    features = ['temperature_c', 'humidity', 'wind_speed_kph', 'precipitation_mm']
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(df[features].fillna(0))
-    weights = np.array([0.4, 0.2, 0.2, 0.2])
-    df['risk_score'] = np.dot(scaled_features, weights)
+def compute_composite_risk_score(df, stats=None, history=None, update_stats=True):
+    # With a WeatherHistory, accumulated rain and pressure tendency also raise the score
+    if history is not None:
+        df = add_history_features(df, history)
+    features, weights = risk_features(history is not None)
+    X = df[features].fillna(0)
+    # Features z-scored at ingest are not normalized a second time
+    scaled = [f for f in features if f not in PRENORMALIZED_FEATURES]
+    columns = [features.index(f) for f in scaled]
+    scaled_features = X.to_numpy(dtype=float)
+    if stats is not None:
+        # Persisted running statistics keep scores comparable between refreshes
+        if update_stats:
+            stats.update(X, scaled)
+        scaled_features[:, columns] = stats.normalize(X, scaled)
+    else:
+        scaler = StandardScaler()
+        scaled_features[:, columns] = scaler.fit_transform(X[scaled])
+    df['risk_score'] = np.dot(scaled_features, np.array(weights))
     return df
 
 
-def cluster_risk_zones(df, n_clusters=3):
-    df = compute_composite_risk_score(df)
+def load_cluster_state(file_path):
+    if not os.path.exists(file_path):
+        return {}
+    return joblib.load(file_path)
+
+
+def save_cluster_state(state, file_path):
+    if os.path.dirname(file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    joblib.dump(state, file_path)
+
+
+def centroid_risk_levels(centroids):
+    # Rank clusters by the risk_score coordinate (first feature) of their centroid
+    order = np.argsort(centroids[:, 0])
+    return {int(cluster): RISK_LEVELS[min(rank, len(RISK_LEVELS) - 1)]
+            for rank, cluster in enumerate(order)}
+
+
+def cluster_risk_zones(df, n_clusters=3, stats=None, state=None, history=None, update_stats=True):
+    """
+    Score and cluster cities into Low/Medium/High risk zones.
+
+    With `state` (a dict, possibly empty, from load_cluster_state) clustering is
+    incremental: a MiniBatchKMeans persisted in the state is updated with partial_fit on
+    the new observations only, and levels follow the centroids' risk_score ranking, so
+    cluster ids and their levels stay stable between refreshes. Without it a fresh
+    KMeans is fitted on the batch. `update_stats` False scores with `stats` without
+    folding the batch into them (a batch they already include).
+    """
+    df = compute_composite_risk_score(df, stats, history, update_stats)
     
     # Use composite risk score and features for clustering
-    features = ['risk_score', 'temperature_c', 'humidity', 'wind_speed_kph', 'precipitation_mm']
+    features = CLUSTER_FEATURES
     X = df[features].fillna(0)
     
+    if state is not None and (state.get('model') is not None or len(X) >= n_clusters):
+        model = state.get('model') or MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3)
+        model.partial_fit(X.to_numpy())
+        state.update(model=model, features=features,
+                     level_map=centroid_risk_levels(model.cluster_centers_),
+                     n_seen=state.get('n_seen', 0) + len(X))
+        df['risk_zone'] = model.predict(X.to_numpy())
+        df['risk_level'] = df['risk_zone'].map(state['level_map'])
+        return df
+    
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
     df['risk_zone'] = kmeans.fit_predict(X)
     
@@ -136,116 +198,166 @@ def cluster_risk_zones(df, n_clusters=3):
     return df
 
 
-def identify_safe_zones_near_cities(df, distance_km=20):
+def fit_risk_model(df, stats=None, state=None, use_history=False):
+    """
+    Capture the scaling, weights and centroids behind a clustered frame as a RiskModel,
+    so new observations can be scored later without refitting.
+    """
+    features, weights = risk_features(use_history)
+    X = df[features].fillna(0)
+    prenormalized = X.columns.isin(PRENORMALIZED_FEATURES)
+    if stats is not None:
+        mean = [0.0 if f in PRENORMALIZED_FEATURES else stats.mean(f) for f in features]
+        scale = [1.0 if f in PRENORMALIZED_FEATURES else stats.std(f) for f in features]
+    else:
+        # Same population statistics StandardScaler fitted in compute_composite_risk_score
+        mean = np.where(prenormalized, 0.0, X.mean().to_numpy())
+        scale = np.where(prenormalized, 1.0, X.std(ddof=0).to_numpy())
+    if state:
+        centroids = state['model'].cluster_centers_
+        level_map = state['level_map']
+    else:
+        # A converged KMeans centroid is the mean of its members
+        clusters = df.groupby('risk_zone')
+        centroids = clusters[CLUSTER_FEATURES].apply(lambda g: g.fillna(0).mean()).to_numpy()
+        level_map = clusters['risk_level'].first().to_dict()
+    return RiskModel(mean, scale, weights, centroids, level_map, features, n_train=len(df))
+
+
+def score_only(input_file, output_file, model_path=None, model_dir=MODEL_DIR, history_dir=HISTORY_DIR):
+    try:
+        model = load_risk_model(model_path, model_dir)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return None
+    df = load_weather_data(input_file)
+    if df is None:
+        return None
+    if set(HISTORY_FEATURES) & set(model.features) - set(df.columns):
+        df = add_history_features(df, WeatherHistory(history_dir))
+    start = time.perf_counter()
+    df = model.score(df)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {len(df)} rows with risk model {model.version} in {elapsed * 1000:.2f} ms "
+          f"({elapsed * 1e6 / max(len(df), 1):.2f} µs/row)")
+    df.to_csv(output_file, index=False)
+    print(f"Scored data saved to {output_file}")
+    return df
+
+
+def _directional_weather(df, grid_observations, bearings, radii, feature, city_feature=None):
+    # (cities, directions, radii) array of `feature`, observed where the grid has it and read
+    # from the city's `city_feature` column (same units, default `feature`) elsewhere
+    city_feature = city_feature or feature
+    city_values = df[city_feature] if city_feature in df else pd.Series(np.nan, index=df.index)
+    values = np.broadcast_to(
+        city_values.to_numpy(dtype=float)[:, None, None], (len(df), len(bearings), len(radii))
+    ).copy()
+    if grid_observations is None or grid_observations.empty:
+        return values
+    observed = grid_observations.assign(
+        bearing_deg=grid_observations['bearing_deg'].astype(float).round(6),
+        distance_km=grid_observations['distance_km'].astype(float).round(6),
+    ).drop_duplicates(['city', 'bearing_deg', 'distance_km'])
+    observed = observed.set_index(['city', 'bearing_deg', 'distance_km'])[feature]
+    index = pd.MultiIndex.from_product([df['city'], np.round(bearings, 6), np.round(radii, 6)])
+    grid = observed.reindex(index).to_numpy(dtype=float).reshape(values.shape)
+    return np.where(np.isnan(grid), values, grid)
+
+
+def identify_safe_zones_near_cities(df, distance_km=20, grid_observations=None,
+                                    n_directions=8, radii_km=None):
     """
     For each city, identify ONE safe zone nearby in the safest direction
     based on weather data analysis.
-    
+
+    Every city x bearing x radius candidate is scored in one broadcast NumPy pass.
+    Candidates sit at great-circle offsets, so east-west distances stay correct
+    away from the equator.
+
     Args:
         df: DataFrame with city risk data
         distance_km: Distance in km to place safe zone from city center
-    
+        grid_observations: Optional weather observed around each city
+            (weather_grid_observations.csv); candidates without one use the city's readings
+        n_directions: Number of evenly spaced bearings to evaluate
+        radii_km: Optional list of candidate distances (defaults to [distance_km])
+
     Returns:
         DataFrame with safe zones (one per city)
     """
-    safe_zones = []
-    
-    # Conversion factor: 1 degree ≈ 111 km
-    distance_deg = distance_km / 111.0
-    
-    # Directions to check (N, NE, E, SE, S, SW, W, NW)
-    directions = [
-        (0, distance_deg, 'North'),
-        (distance_deg * 0.707, distance_deg * 0.707, 'NorthEast'),
-        (distance_deg, 0, 'East'),
-        (distance_deg * 0.707, -distance_deg * 0.707, 'SouthEast'),
-        (0, -distance_deg, 'South'),
-        (-distance_deg * 0.707, -distance_deg * 0.707, 'SouthWest'),
-        (-distance_deg, 0, 'West'),
-        (-distance_deg * 0.707, distance_deg * 0.707, 'NorthWest')
-    ]
-    
-    for idx, city_row in df.iterrows():
-        city_name = city_row['city']
-        city_lon = city_row['longitude']
-        city_lat = city_row['latitude']
-        city_risk = city_row['risk_score']
-        
-        # Analyze weather patterns to determine safest direction
-        # Lower temperature, lower wind, lower precipitation = safer
-        best_direction = None
-        lowest_risk = float('inf')
-        best_coords = None
-        
-        # Check each direction
-        for lon_offset, lat_offset, direction_name in directions:
-            safe_lon = city_lon + lon_offset
-            safe_lat = city_lat + lat_offset
-            
-            # Calculate estimated risk in that direction
-            # Use inverse of city risk with some randomness for directionality
-            # In real scenario, you'd query actual weather data at those coordinates
-            
-            # Simple heuristic: areas opposite to wind direction are safer
-            wind_factor = 1.0
-            if city_row['wind_speed_kph'] > 20:  # High wind
-                # Prefer perpendicular directions to wind
-                wind_factor = 0.8
-            
-            # Lower precipitation areas are safer
-            precip_factor = 1.0 - (city_row['precipitation_mm'] / 100.0)
-            precip_factor = max(0.5, min(1.0, precip_factor))
-            
-            # Calculate directional risk score
-            directional_risk = city_risk * wind_factor * precip_factor
-            
-            # Add slight preference for certain directions based on weather
-            if city_row['temperature_c'] > 30:  # Hot weather
-                # Prefer north/northeast (cooler)
-                if 'North' in direction_name or 'East' in direction_name:
-                    directional_risk *= 0.9
-            
-            if city_row['precipitation_mm'] > 50:  # Heavy rain
-                # Prefer elevated areas (assume east/northeast)
-                if 'East' in direction_name or 'North' in direction_name:
-                    directional_risk *= 0.85
-            
-            if directional_risk < lowest_risk:
-                lowest_risk = directional_risk
-                best_direction = direction_name
-                best_coords = (safe_lon, safe_lat)
-        
-        # Create safe zone entry
-        safe_zone = {
-            'city': city_name,
-            'safe_zone_id': f"SafeZone_{city_name}",
-            'longitude': best_coords[0],
-            'latitude': best_coords[1],
-            'risk_score': lowest_risk,
-            'direction': best_direction,
-            'distance_km': distance_km
-        }
-        safe_zones.append(safe_zone)
-        print(f"Safe zone for {city_name}: {best_direction} direction, risk score: {lowest_risk:.2f}")
-    
-    safe_zones_df = pd.DataFrame(safe_zones)
+    directions = compass_directions(n_directions)
+    names = np.array([name for name, _ in directions])
+    bearings = np.array([bearing for _, bearing in directions])
+    radii = np.asarray(radii_km if radii_km else [distance_km], dtype=float)
+
+    wind = _directional_weather(df, grid_observations, bearings, radii, 'wind_speed_kph')
+    precipitation = _directional_weather(df, grid_observations, bearings, radii, 'precipitation_mm')
+    # Grid cells report degrees C, while the city's temperature_c is z-scored; compare raw
+    # readings only (no heat preference for cities without temperature_raw_c)
+    temperature = _directional_weather(df, grid_observations, bearings, radii, 'temperature_c',
+                                       city_feature='temperature_raw_c')
+
+    # Simple heuristic: areas opposite to wind direction are safer
+    wind_factor = np.where(wind > 20, 0.8, 1.0)
+    # Lower precipitation areas are safer
+    precip_factor = np.clip(1.0 - precipitation / 100.0, 0.5, 1.0)
+    city_risk = df['risk_score'].to_numpy(dtype=float)[:, None, None]
+    directional_risk = city_risk * wind_factor * precip_factor
+
+    # Bearings with a northern or eastern component
+    theta = np.radians(bearings)
+    north_or_east = ((np.cos(theta) > 1e-9) | (np.sin(theta) > 1e-9))[None, :, None]
+    # Hot weather: prefer north/northeast (cooler)
+    directional_risk *= np.where((temperature > 30) & north_or_east, 0.9, 1.0)
+    # Heavy rain: prefer elevated areas (assume east/northeast)
+    directional_risk *= np.where((precipitation > 50) & north_or_east, 0.85, 1.0)
+
+    # Safest candidate per city; ties go to the earlier bearing, then the nearer radius
+    flat_risk = directional_risk.reshape(len(df), -1)
+    best = flat_risk.argmin(axis=1)
+    best_direction, best_radius = np.unravel_index(best, (len(bearings), len(radii)))
+    safe_lat, safe_lon = destination_points(
+        df['latitude'].to_numpy(dtype=float), df['longitude'].to_numpy(dtype=float),
+        bearings[best_direction], radii[best_radius],
+    )
+
+    safe_zones_df = pd.DataFrame({
+        'city': df['city'].to_numpy(),
+        'safe_zone_id': "SafeZone_" + df['city'].astype(str).to_numpy(),
+        'longitude': safe_lon,
+        'latitude': safe_lat,
+        'risk_score': flat_risk[np.arange(len(df)), best],
+        'direction': names[best_direction],
+        'bearing_deg': bearings[best_direction],
+        'distance_km': radii[best_radius],
+    })
+    if len(safe_zones_df) <= 50:
+        for row in safe_zones_df.itertuples():
+            print(f"Safe zone for {row.city}: {row.direction} direction, risk score: {row.risk_score:.2f}")
     print(f"\nIdentified {len(safe_zones_df)} safe zones (one per city)")
     return safe_zones_df
 
 
-def allocate_resources(df, available_resources):
-    resources = {
-        'ambulances': available_resources.get('ambulances', 20),
-        'shelters': available_resources.get('shelters', 10),
-        'rescue_teams': available_resources.get('rescue_teams', 15)
-    }
+def allocate_resources(df, available_resources, method='apportion', caps=None, minimums=None):
+    """
+    Allocate every resource type in `available_resources` (merged over DEFAULT_RESOURCES)
+    to regions by risk priority; totals always match what is available.
+
+    `caps` and `minimums` are {resource: scalar or per-row array}. Per-region demand is
+    read from `<resource>_demand` columns and travel cost from a `travel_cost` column
+    when present (travel cost only matters for method='lp').
+    """
+    resources = {**DEFAULT_RESOURCES, **available_resources}
     risk_priority = {'High': 3, 'Medium': 2, 'Low': 1}
-    df['priority'] = df['risk_level'].map(risk_priority)
-    df = df.sort_values('priority', ascending=False)
-    total_priority = df['priority'].sum()
-    if total_priority > 0:
-        for resource, quantity in resources.items():
-            df[resource] = (df['priority'] / total_priority * quantity).round().astype(int)
+    df['priority'] = df['risk_level'].map(risk_priority).fillna(0)
+    df = df.sort_values('priority', ascending=False, kind='stable')
+    demand = {resource: df[f"{resource}_demand"].to_numpy() for resource in resources
+              if f"{resource}_demand" in df}
+    travel_cost = df['travel_cost'].to_numpy() if 'travel_cost' in df else None
+    allocation = allocate(df['priority'].to_numpy(), resources, method, caps, minimums, demand, travel_cost)
+    for resource in resources:
+        df[resource] = allocation[resource].to_numpy()
     return df
 
 
@@ -254,20 +366,80 @@ def save_geojson(gdf, output_file):
     print(f"GeoJSON saved to {output_file}")
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cluster risk zones, allocate resources and place safe zones")
+    parser.add_argument("--stats-path", default=os.path.join(STATS_DIR, "risk_stats.json"),
+                        help="Running feature statistics used to scale the risk score")
+    parser.add_argument("--stats-decay", type=float, default=STATS_DECAY,
+                        help="Weight kept by past refreshes on every update (1.0 = no forgetting)")
+    parser.add_argument("--batch-stats", action="store_true",
+                        help="Refit the scaler on the current batch only")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Update the persisted MiniBatchKMeans with the new observations instead of refitting")
+    parser.add_argument("--cluster-state", default=os.path.join(MODEL_DIR, "risk_clusters.joblib"),
+                        help="Persisted clustering state used by --incremental")
+    parser.add_argument("--directions", type=int, default=8,
+                        help="Number of bearings evaluated when placing safe zones")
+    parser.add_argument("--safe-zone-radii", default="20",
+                        help="Comma-separated candidate safe-zone distances in km")
+    parser.add_argument("--allocation", choices=ALLOCATION_METHODS, default='apportion',
+                        help="Largest-remainder apportionment or an LP with demand and travel cost")
+    parser.add_argument("--max-per-region", type=int,
+                        help="Cap on each resource type per region")
+    parser.add_argument("--min-per-region", type=int,
+                        help="Minimum coverage of each resource type per region")
+    parser.add_argument("--use-history", action="store_true",
+                        help="Add rolling rain/pressure features from the weather history store to the risk score")
+    parser.add_argument("--history-dir", default=HISTORY_DIR,
+                        help="Weather history store written by fetch_weather_data.py")
+    parser.add_argument("--model-dir", default=MODEL_DIR,
+                        help="Directory for versioned risk model artifacts")
+    parser.add_argument("--score-only", action="store_true",
+                        help="Score --input with the saved risk model instead of refitting")
+    parser.add_argument("--model", help="Risk model artifact for --score-only (default: latest)")
+    parser.add_argument("--input", default="preprocessed_weather_data.csv",
+                        help="Observations to score with --score-only")
+    parser.add_argument("--scored-output", default="scored_risk_zones.csv",
+                        help="Output CSV for --score-only")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.score_only:
+        score_only(args.input, args.scored_output, args.model, args.model_dir, args.history_dir)
+        return
     input_file = "preprocessed_weather_data.csv"
     output_csv = "clustered_risk_zones.csv"
     output_risk_geojson = "clustered_risk_zones.geojson"
     output_safe_zones_geojson = "safe_zones.geojson"
+    grid_file = "weather_grid_observations.csv"
     
     df = load_weather_data(input_file)
     if df is None:
         return
     
-    df = cluster_risk_zones(df)
+    stats = None if args.batch_stats else RunningStats.load(args.stats_path, args.stats_decay)
+    state = load_cluster_state(args.cluster_state) if args.incremental else None
+    history = WeatherHistory(args.history_dir) if args.use_history else None
+    # Fold each fetch into the statistics once; reruns and replays only score with them
+    refreshed_at = str(df['refreshed_at'].max()) if 'refreshed_at' in df else None
+    update_stats = stats is not None and not stats.seen(refreshed_at)
+    if stats is not None and not update_stats:
+        print(f"Risk statistics already include the batch fetched at {refreshed_at}; not updating them")
+    df = cluster_risk_zones(df, stats=stats, state=state, history=history, update_stats=update_stats)
+    if update_stats:
+        stats.refreshed_at = refreshed_at or stats.refreshed_at
+        stats.save()
+    if state:
+        save_cluster_state(state, args.cluster_state)
+        print(f"Cluster state saved to {args.cluster_state} ({state['n_seen']} observations seen)")
+    save_risk_model(fit_risk_model(df, stats, state, args.use_history), args.model_dir)
     
     available_resources = {'ambulances': 50, 'shelters': 20, 'rescue_teams': 30}
-    df = allocate_resources(df, available_resources)
+    caps = {resource: args.max_per_region for resource in available_resources} if args.max_per_region else None
+    minimums = {resource: args.min_per_region for resource in available_resources} if args.min_per_region else None
+    df = allocate_resources(df, available_resources, args.allocation, caps, minimums)
     
     df.to_csv(output_csv, index=False)
     print(f"Clustered data saved to {output_csv}")
@@ -281,7 +453,14 @@ def main():
     save_geojson(risk_gdf, output_risk_geojson)
     
     # Identify and save safe zones (one per city, nearby)
-    safe_zones = identify_safe_zones_near_cities(df, distance_km=20)
+    grid_observations = None
+    if os.path.exists(grid_file):
+        grid_observations = pd.read_csv(grid_file)
+        print(f"Using {len(grid_observations)} grid observations from {grid_file}")
+    radii_km = [float(r) for r in args.safe_zone_radii.split(",")]
+    safe_zones = identify_safe_zones_near_cities(df, distance_km=radii_km[0],
+                                                 grid_observations=grid_observations,
+                                                 n_directions=args.directions, radii_km=radii_km)
     if not safe_zones.empty:
         safe_zone_gdf = gpd.GeoDataFrame(
             safe_zones,
@@ -145,32 +145,82 @@
 
 
 import streamlit as st
+import pandas as pd
 import geopandas as gpd
+import shapely
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 import os
 import glob
-import time
-import subprocess
+import requests
+from pipeline_refresh import PipelineRefresher
 
 st.set_page_config(page_title="Disaster Response Dashboard", layout="wide")
 
+# e.g. http://127.0.0.1:8765 for a local routing_service.py
+ROUTING_SERVICE_URL = os.getenv("ROUTING_SERVICE_URL")
+# Parsed GeoJSON layers kept in memory; the least recently used are evicted first
+GEOJSON_CACHE_ENTRIES = int(os.getenv("GEOJSON_CACHE_ENTRIES", 16))
+# Map features (cities + routes + safe zones) above which the map is drawn from bulk layers
+BULK_MAP_THRESHOLD = int(os.getenv("BULK_MAP_THRESHOLD", 500))
+# Grid, in degrees, that bulk layer coordinates are snapped to (~1 m)
+MAP_COORD_PRECISION = 1e-5
+RISK_COLORS = {"Low": "green", "Medium": "orange", "High": "red"}
+# Risk columns shown in the bulk layer popups, with their labels
+RISK_POPUP_FIELDS = {"city": "🏙️ City", "risk_level": "Risk Level", "temperature_c": "Temperature (°C)",
+                     "humidity": "Humidity (%)", "wind_speed_kph": "Wind Speed (kph)",
+                     "precipitation_mm": "Precipitation (mm)", "alert_level": "Alert Level",
+                     "alert_type": "Alert Type", "risk_score": "Risk Score"}
+# Builds each safe zone marker in the browser from a [lat, lon, safe_zone_id, city] row
+SAFE_ZONE_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip("Safe Zone for " + row[3]);
+    marker.bindPopup("<b>✅ Safe Zone: " + row[2] + "</b><br>City: " + row[3]);
+    return marker;
+};
+"""
+
+@st.cache_resource(max_entries=GEOJSON_CACHE_ENTRIES, show_spinner=False)
+def _read_geojson(file_path, mtime_ns, size):
+    # mtime_ns and size only key the cache: a file rewritten by the pipeline is parsed again.
+    # The GeoDataFrame is shared between reruns and sessions, so callers must not modify it.
+    return gpd.read_file(file_path)
+
 def load_geojson(file_path):
-    if not os.path.exists(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
         st.error(f"GeoJSON file not found: {file_path}")
         return None
     try:
-        gdf = gpd.read_file(file_path)
+        gdf = _read_geojson(file_path, stat.st_mtime_ns, stat.st_size)
         return gdf
     except Exception as e:
         st.error(f"Error loading GeoJSON: {file_path}: {e}")
         return None
 
-def create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_focus):
+def load_service_routes(url):
+    """Current routes from a running routing_service.py, or None if it cannot be reached."""
+    try:
+        response = requests.get(f"{url.rstrip('/')}/routes", timeout=5)
+        response.raise_for_status()
+        features = response.json()["features"]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        st.warning(f"⚠️ Routing service unavailable ({e}); showing routes from files")
+        return None
+    if not features:
+        return gpd.GeoDataFrame(columns=['city', 'safe_zone_id', 'geometry'], geometry='geometry', crs="EPSG:4326")
+    return gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+
+def create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_focus, bulk=False):
+    if bulk:
+        return create_bulk_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities)
     center_lat = risk_gdf["latitude"].mean()
     center_lon = risk_gdf["longitude"].mean()
     m = folium.Map(location=[center_lat, center_lon], zoom_start=6)
-    color_map = {"Low": "green", "Medium": "orange", "High": "red"}
+    color_map = RISK_COLORS
 
     # Filter risk data by selected cities
     risk_gdf_filtered = risk_gdf[risk_gdf["city"].isin(selected_cities)]
@@ -244,8 +294,70 @@ def create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_f
                 ),
                 tooltip=f"Safe Zone for {row.get('city', 'Unknown')}"
             ).add_to(m)
-    
-    # Add legend
+
+    add_legend(m, route_count)
+
+    return m
+
+def create_bulk_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities):
+    """
+    Same layers as create_map, for thousands of features: cities and routes are each a
+    single GeoJson FeatureCollection, styled and given popups in the browser, and safe
+    zones are a FastMarkerCluster fed with a plain coordinate array. Routes have no
+    direction arrows in this mode.
+    """
+    center_lat = risk_gdf["latitude"].mean()
+    center_lon = risk_gdf["longitude"].mean()
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=6, prefer_canvas=True)
+
+    # Routes first, so they are drawn under the markers
+    routes = [route_gdf.loc[route_gdf["city"].isin(selected_cities), ["city", "geometry"]]
+              for route_gdf in route_gdfs or [] if route_gdf is not None and 'city' in route_gdf.columns]
+    routes = gpd.GeoDataFrame(pd.concat(routes, ignore_index=True), crs="EPSG:4326") if routes else None
+    route_count = 0
+    if routes is not None and not routes.empty:
+        routes["geometry"] = shapely.set_precision(routes.geometry.values, MAP_COORD_PRECISION)
+        folium.GeoJson(
+            routes,
+            name="Evacuation Routes",
+            style_function=lambda feature: {"color": "#0066FF", "weight": 4, "opacity": 0.8},
+            tooltip=folium.GeoJsonTooltip(fields=["city"], aliases=["🚨 Route from"]),
+        ).add_to(m)
+        route_count = len(routes)
+
+    risk_gdf_filtered = risk_gdf[risk_gdf["city"].isin(selected_cities)]
+    fields = [col for col in RISK_POPUP_FIELDS if col in risk_gdf_filtered.columns]
+    risk_points = risk_gdf_filtered[fields + ["geometry"]].copy()
+    if "humidity" in risk_points.columns:
+        risk_points["humidity"] = risk_points["humidity"] * 100
+    risk_points = risk_points.round(2)
+    risk_points["geometry"] = shapely.set_precision(risk_points.geometry.values, MAP_COORD_PRECISION)
+    folium.GeoJson(
+        risk_points,
+        name="Risk Zones",
+        marker=folium.CircleMarker(radius=8, fill=True, fill_opacity=0.7),
+        style_function=lambda feature: {
+            "color": RISK_COLORS.get(feature["properties"]["risk_level"], "blue"),
+            "fillColor": RISK_COLORS.get(feature["properties"]["risk_level"], "blue"),
+        },
+        popup=folium.GeoJsonPopup(fields=fields, aliases=[RISK_POPUP_FIELDS[col] for col in fields]),
+        tooltip=folium.GeoJsonTooltip(fields=["city", "risk_level"], aliases=["City", "Risk"]),
+    ).add_to(m)
+
+    if not safe_zones_gdf.empty and 'city' in safe_zones_gdf.columns:
+        safe_zones_filtered = safe_zones_gdf[safe_zones_gdf["city"].isin(selected_cities)]
+        if not safe_zones_filtered.empty:
+            # [lat, lon] rows in one vectorized step instead of swapping every pair in Python
+            lat_lon = shapely.get_coordinates(safe_zones_filtered.geometry.values)[:, ::-1].round(5)
+            ids = safe_zones_filtered.get("safe_zone_id", safe_zones_filtered["city"]).astype(str)
+            data = [[lat, lon, zone_id, city] for (lat, lon), zone_id, city
+                    in zip(lat_lon.tolist(), ids, safe_zones_filtered["city"].astype(str))]
+            FastMarkerCluster(data, callback=SAFE_ZONE_CALLBACK, name="Safe Zones").add_to(m)
+
+    add_legend(m, route_count)
+    return m
+
+def add_legend(m, route_count):
     legend_html = f'''
     <div style="position: fixed; 
                 bottom: 50px; right: 50px; width: 220px; height: auto; 
@@ -262,41 +374,62 @@ def create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_f
     '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
-    return m
-
-def update_weather_data():
-    subprocess.run(["python", "fetch_weather_data.py"])
+@st.cache_resource
+def get_refresher():
+    # One background refresher per server process, shared by every session
+    return PipelineRefresher()
+
+@st.fragment(run_every=5)
+def refresh_status(refresher, shown_snapshot):
+    status = refresher.status()
+    if status["running"]:
+        st.info(f"🔄 Refreshing data: {status['stage'] or 'starting'}...")
+    elif status["last_error"]:
+        st.error(f"Last refresh failed: {status['last_error']}")
+    # Swap in the new layers as soon as a refresh publishes them
+    if refresher.current() != shown_snapshot:
+        st.rerun()
 
 def main():
     st.title("🚨 AI-Powered Disaster Response")
     st.markdown("Visualizing risk zones, safe zones, and **evacuation routes** for disaster response.")
 
-    if 'last_update' not in st.session_state:
-        st.session_state.last_update = time.time()
-
-    if time.time() - st.session_state.last_update > 1800:  # 30 minutes
-        update_weather_data()
-        st.session_state.last_update = time.time()
-        st.rerun()
-
-    risk_geojson = "clustered_risk_zones.geojson"
+    # Fetch -> cluster -> route runs in the background every 30 minutes or on demand
+    refresher = get_refresher()
+    refresher.maybe_refresh()
+    data_dir = refresher.current()
+    as_of = refresher.as_of()
+    st.caption(f"🕒 Data as of {as_of:%Y-%m-%d %H:%M:%S}" if as_of else "🕒 No data yet")
+    if st.sidebar.button("🔄 Refresh data now", disabled=refresher.status()["running"]):
+        refresher.trigger()
+    with st.sidebar:
+        refresh_status(refresher, data_dir)
+    data_dir = data_dir or "."
+
+    risk_geojson = os.path.join(data_dir, "clustered_risk_zones.geojson")
     risk_gdf = load_geojson(risk_geojson)
     if risk_gdf is None:
         return
 
     # Load AI-identified safe zones
-    safe_zones_file = "safe_zones.geojson"
+    safe_zones_file = os.path.join(data_dir, "safe_zones.geojson")
     safe_zones_gdf = load_geojson(safe_zones_file)
     if safe_zones_gdf is None:
         safe_zones_gdf = gpd.GeoDataFrame(columns=['safe_zone_id', 'city', 'latitude', 'longitude', 'risk_score'])
         st.warning("⚠️ No safe zones identified yet. Run cluster_risk_zones.py first.")
 
-    # Load evacuation routes
-    route_files = glob.glob("dynamic_evacuation_routes.geojson")
-    if not route_files:
-        route_files = glob.glob("evacuation_route_*.geojson")
-    route_gdfs = [load_geojson(f) for f in route_files]
-    route_gdfs = [gdf for gdf in route_gdfs if gdf is not None]
+    # Load evacuation routes, from the routing service when one is configured
+    route_gdfs = []
+    if ROUTING_SERVICE_URL:
+        service_routes = load_service_routes(ROUTING_SERVICE_URL)
+        if service_routes is not None:
+            route_gdfs = [service_routes]
+    if not route_gdfs:
+        route_files = glob.glob(os.path.join(data_dir, "dynamic_evacuation_routes.geojson"))
+        if not route_files:
+            route_files = glob.glob(os.path.join(data_dir, "evacuation_route_*.geojson"))
+        route_gdfs = [load_geojson(f) for f in route_files]
+        route_gdfs = [gdf for gdf in route_gdfs if gdf is not None]
     
     if not route_gdfs or all(gdf.empty for gdf in route_gdfs):
         st.warning("⚠️ No evacuation routes found. Run optimize_routes.py to generate routes.")
@@ -328,8 +461,13 @@ def main():
         selected_routes = len(route_gdfs[0][route_gdfs[0]['city'].isin(selected_cities)]) if 'city' in route_gdfs[0].columns else 0
         st.sidebar.info(f"📍 Total Cities: {len(all_cities)}\n\n🛣️ Routes Displayed: {selected_routes}/{total_routes}")
 
+    # Large maps are drawn from a few bulk layers instead of one folium object per feature
+    feature_count = len(risk_gdf) + len(safe_zones_gdf) + sum(len(gdf) for gdf in route_gdfs)
+    bulk = st.sidebar.toggle("⚡ Fast map rendering", value=feature_count > BULK_MAP_THRESHOLD,
+                             help="Draw cities, routes and safe zones as bulk layers; suited to thousands of features")
+
     st.subheader("🗺️ Interactive Map: Risk Zones, Safe Zones & Evacuation Routes")
-    folium_map = create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_focus)
+    folium_map = create_map(risk_gdf, safe_zones_gdf, route_gdfs, selected_cities, disaster_focus, bulk=bulk)
     st_folium(folium_map, width=1200, height=600)
 
     # Display safe zones info for selected cities only
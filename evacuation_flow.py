@@ -0,0 +1,257 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy import sparse
+from scipy.optimize import linprog
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString
+from road_network import ROAD_CACHE_DIR, ROAD_WEIGHT, _haversine_m, _unit_vectors, load_road_network
+
+
+# Used when the input has no population / capacity columns
+EVACUEES_PER_CITY = int(os.getenv("EVACUEES_PER_CITY", 1000))
+SHELTER_CAPACITY = int(os.getenv("SHELTER_CAPACITY", 500))
+# People per road edge over the evacuation window; 0 leaves roads uncapacitated
+ROAD_CAPACITY = int(os.getenv("ROAD_CAPACITY", 0))
+# Without a road network every origin links straight to this many nearest safe zones
+FLOW_CANDIDATES = int(os.getenv("FLOW_CANDIDATES", 5))
+
+
+def solve_min_cost_flow(n_nodes, u, v, capacity, cost, supply):
+    """
+    Min-cost flow as a transshipment LP (HiGHS).
+
+    Node-arc incidence matrices are totally unimodular, so with integer supplies and
+    capacities the simplex vertex is integral without branch-and-bound.
+
+    Args:
+        n_nodes: Number of nodes
+        u, v, capacity, cost: (m,) edge arrays; capacity may be np.inf
+        supply: (n_nodes,) net outflow per node (negative for sinks), summing to zero
+
+    Returns:
+        (m,) integer flow per edge
+    """
+    m = len(u)
+    # +1 where an edge leaves a node, -1 where it enters
+    A = sparse.csr_matrix((np.concatenate([np.ones(m), -np.ones(m)]),
+                           (np.concatenate([u, v]), np.tile(np.arange(m), 2))), shape=(n_nodes, m))
+    result = linprog(cost, A_eq=A, b_eq=supply, bounds=np.column_stack([np.zeros(m), capacity]), method='highs')
+    if not result.success:
+        raise RuntimeError(f"Evacuation flow LP failed: {result.message}")
+    return np.round(result.x).astype(np.int64)
+
+
+def decompose_flow(u, v, flow, origins, zones, served):
+    """
+    Split an edge flow into origin -> zone paths.
+
+    Args:
+        u, v, flow: Edge arrays of the flow network (without source and sink edges)
+        origins: (k,) node of every origin
+        zones: (z,) node of every zone
+        served: ((k,) people leaving every origin, (z,) people arriving at every zone)
+
+    Returns:
+        List of (origin position, zone position, people, [nodes])
+    """
+    departures, arrivals = served
+    positive = np.flatnonzero(flow > 0)
+    remaining = {int(e): int(flow[e]) for e in positive}
+    out_edges = {}
+    for e in positive.tolist():
+        out_edges.setdefault(int(u[e]), []).append(e)
+    zone_room = {}
+    for position, node in enumerate(np.asarray(zones).tolist()):
+        if arrivals[position] > 0:
+            zone_room.setdefault(node, []).append([position, int(arrivals[position])])
+    paths = []
+    for origin, node in enumerate(np.asarray(origins).tolist()):
+        left = int(departures[origin])
+        while left > 0:
+            path, edges, x = [node], [], node
+            # Stop at the first node with shelter room left; otherwise follow any edge still carrying flow
+            while not zone_room.get(x):
+                e = next(e for e in out_edges[x] if remaining[e] > 0)
+                edges.append(e)
+                x = int(v[e])
+                path.append(x)
+            room = zone_room[x][0]
+            people = min([left, room[1]] + [remaining[e] for e in edges])
+            for e in edges:
+                remaining[e] -= people
+            room[1] -= people
+            if room[1] == 0:
+                zone_room[x].pop(0)
+            left -= people
+            paths.append((origin, room[0], people, path))
+    return paths
+
+
+def plan_evacuation(n_nodes, u, v, cost, origins, population, zones, shelter_capacity, road_capacity=None):
+    """
+    Assign people from every origin node to safe zone nodes over a routing graph at minimum
+    total cost, within shelter and road capacities.
+
+    A super-source feeds every origin its population and every zone drains into a
+    super-sink up to its capacity. People who cannot be placed take a direct
+    source -> sink "unserved" edge that costs more than any route, so the problem is
+    always feasible and as many people as possible are served.
+
+    Args:
+        n_nodes: Nodes of the routing graph
+        u, v, cost: (m,) directed edges and their costs
+        origins, population: (k,) origin nodes and people to move
+        zones, shelter_capacity: (z,) safe zone nodes and how many people each can take
+        road_capacity: Optional scalar or (m,) people per edge (default: uncapacitated)
+
+    Returns:
+        (paths, unserved) with paths from `decompose_flow` and (k,) people left per origin
+    """
+    population = np.asarray(population, dtype=np.int64)
+    shelter_capacity = np.asarray(shelter_capacity, dtype=np.int64)
+    m, k, z = len(u), len(origins), len(zones)
+    source, sink = n_nodes, n_nodes + 1
+    if road_capacity is None or (np.isscalar(road_capacity) and road_capacity <= 0):
+        road_capacity = np.inf
+    finite_cost = np.asarray(cost, dtype=float)
+    total = int(population.sum())
+    all_u = np.concatenate([u, np.full(k, source), zones, [source]])
+    all_v = np.concatenate([v, origins, np.full(z, sink), [sink]])
+    capacity = np.concatenate([np.broadcast_to(road_capacity, m), population, shelter_capacity, [total]])
+    unserved_cost = finite_cost[np.isfinite(finite_cost)].sum() + 1.0
+    all_cost = np.concatenate([finite_cost, np.zeros(k + z), [unserved_cost]])
+    # Blocked roads carry nothing
+    capacity = np.where(np.isfinite(all_cost), capacity, 0.0)
+    all_cost = np.where(np.isfinite(all_cost), all_cost, 0.0)
+    supply = np.zeros(n_nodes + 2)
+    supply[source], supply[sink] = total, -total
+    flow = solve_min_cost_flow(n_nodes + 2, all_u, all_v, capacity, all_cost, supply)
+    departures, arrivals = flow[m:m + k], flow[m + k:m + k + z]
+    paths = decompose_flow(u, v, flow[:m], origins, zones, (departures, arrivals))
+    return paths, population - departures
+
+
+def flows_to_geodataframe(paths, origin_df, zone_df, coordinates, cost_of):
+    """GeoDataFrame with one row per (city, safe zone) route and the people sent along it."""
+    rows = []
+    for origin, zone, people, path in paths:
+        city, safe_zone = origin_df.iloc[origin], zone_df.iloc[zone]
+        coords = ([(city['longitude'], city['latitude'])] + coordinates(path)
+                  + [(safe_zone['longitude'], safe_zone['latitude'])])
+        rows.append({'city': city['city'], 'safe_zone_id': safe_zone['safe_zone_id'], 'evacuees': people,
+                     'route_cost': cost_of(path), 'geometry': LineString(coords)})
+    columns = ['city', 'safe_zone_id', 'evacuees', 'route_cost', 'geometry']
+    return gpd.GeoDataFrame(rows, columns=columns, geometry='geometry', crs='EPSG:4326')
+
+
+def _column(df, name, default):
+    if name in df:
+        return pd.to_numeric(df[name], errors='coerce').fillna(default).round().astype(np.int64).to_numpy()
+    return np.full(len(df), default, dtype=np.int64)
+
+
+def plan_road_evacuation(network, df, safe_zones, population, capacity, road_capacity=None):
+    """Evacuation flow over a RoadNetwork, with cities and safe zones snapped to their nearest road nodes."""
+    origins = network.nearest_nodes(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+    zones = network.nearest_nodes(safe_zones['longitude'].to_numpy(), safe_zones['latitude'].to_numpy())
+    u = np.repeat(np.arange(network.n_nodes), np.diff(network.indptr))
+    v = np.asarray(network.indices)
+    weights = np.asarray(network.weights)
+    paths, unserved = plan_evacuation(network.n_nodes, u, v, weights, origins, population,
+                                      zones, capacity, road_capacity)
+    edge_cost = {}
+
+    def cost_of(path):
+        total = 0.0
+        for a, b in zip(path, path[1:]):
+            if (a, b) not in edge_cost:
+                start = network.indptr[a]
+                edge_cost[a, b] = weights[start + np.flatnonzero(v[start:network.indptr[a + 1]] == b)[0]]
+            total += edge_cost[a, b]
+        return total
+
+    return flows_to_geodataframe(paths, df, safe_zones, network.coordinates, cost_of), unserved
+
+
+def plan_direct_evacuation(df, safe_zones, population, capacity, candidates=FLOW_CANDIDATES):
+    """Evacuation flow without roads: every city links straight to its `candidates` nearest safe zones (km)."""
+    k = min(candidates, len(safe_zones))
+    tree = cKDTree(_unit_vectors(safe_zones['longitude'].to_numpy(), safe_zones['latitude'].to_numpy()))
+    _, nearest = tree.query(_unit_vectors(df['longitude'].to_numpy(), df['latitude'].to_numpy()), k=k)
+    nearest = nearest.reshape(len(df), k)
+    # Nodes: cities first, then safe zones
+    u = np.repeat(np.arange(len(df)), k)
+    zone_index = nearest.ravel()
+    km = _haversine_m(df['longitude'].to_numpy()[u], df['latitude'].to_numpy()[u],
+                      safe_zones['longitude'].to_numpy()[zone_index],
+                      safe_zones['latitude'].to_numpy()[zone_index]) / 1000.0
+    paths, unserved = plan_evacuation(len(df) + len(safe_zones), u, len(df) + zone_index, km,
+                                      np.arange(len(df)), population,
+                                      len(df) + np.arange(len(safe_zones)), capacity)
+    cost = dict(zip(zip(u.tolist(), (len(df) + zone_index).tolist()), km.tolist()))
+    return flows_to_geodataframe(paths, df, safe_zones, lambda path: [],
+                                 lambda path: sum(cost[a, b] for a, b in zip(path, path[1:]))), unserved
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Assign evacuees to safe zones under shelter and road capacities (min-cost flow)")
+    parser.add_argument("--input", default="clustered_risk_zones.csv")
+    parser.add_argument("--safe-zones", default="safe_zones.geojson")
+    parser.add_argument("--output", default="evacuation_flows.geojson")
+    parser.add_argument("--road-network", help="Local road network (.graphml, .osm or .osm.pbf); straight lines if omitted")
+    parser.add_argument("--road-cache-dir", default=ROAD_CACHE_DIR)
+    parser.add_argument("--road-weight", default=ROAD_WEIGHT)
+    parser.add_argument("--road-capacity", type=int, default=ROAD_CAPACITY,
+                        help="People per road edge over the evacuation window (0: unlimited)")
+    parser.add_argument("--population-column", default="population")
+    parser.add_argument("--default-population", type=int, default=EVACUEES_PER_CITY)
+    parser.add_argument("--capacity-column", default="capacity")
+    parser.add_argument("--default-capacity", type=int, default=SHELTER_CAPACITY)
+    parser.add_argument("--candidates", type=int, default=FLOW_CANDIDATES,
+                        help="Nearest safe zones linked to every city without a road network")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        df = pd.read_csv(args.input)
+        safe_zones = gpd.read_file(args.safe_zones)
+    except Exception as e:
+        print(f"❌ Could not load inputs: {e}")
+        return
+    if safe_zones.empty:
+        print("❌ No safe zones! Run cluster_risk_zones.py first.")
+        return
+    population = _column(df, args.population_column, args.default_population)
+    capacity = _column(safe_zones, args.capacity_column, args.default_capacity)
+    print(f"Evacuating {population.sum()} people from {len(df)} cities to {len(safe_zones)} safe zones "
+          f"(capacity {capacity.sum()})")
+    start = time.perf_counter()
+    try:
+        if args.road_network:
+            network = load_road_network(args.road_network, args.road_cache_dir, args.road_weight)
+            flows, unserved = plan_road_evacuation(network, df, safe_zones, population, capacity, args.road_capacity)
+        else:
+            flows, unserved = plan_direct_evacuation(df, safe_zones, population, capacity, args.candidates)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"❌ Evacuation planning failed: {e}")
+        return
+    print(f"✅ Planned {len(flows)} routes in {time.perf_counter() - start:.2f} s, "
+          f"{int(flows['evacuees'].sum())} people assigned")
+    for city, people in zip(df['city'], unserved):
+        if people > 0:
+            print(f"❌ {city}: {people} people without shelter capacity or road access")
+    if flows.empty:
+        print("❌ No routes to save!")
+        return
+    flows.to_file(args.output, driver='GeoJSON')
+    print(f"✅ Saved evacuation flows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
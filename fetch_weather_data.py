@@ -1,10 +1,30 @@
 
 
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from response_cache import ResponseCache
+from weather_archive import ARCHIVE_DIR, latest_archive, read_archive, write_archive
+from running_stats import STATS_DECAY, STATS_DIR, RunningStats
+from weather_history import HISTORY_DIR, WeatherHistory
+from weather_grid import GRID_CACHE_TTL, GRID_DISTANCE_KM, GRID_PRECISION, compass_directions, sample_grid
+from rate_limiter import get_bucket
 
 # Load environment variables
 load_dotenv()
@@ -13,8 +33,169 @@ print(f"API Key: {API_KEY}")
 
 # Base URL for WeatherAPI.com
 BASE_URL = "http://api.weatherapi.com/v1/current.json"
+ALERTS_URL = "https://www.gdacs.org/API/v1/alerts"
+# Global GDACS event feed (GeoJSON) used by the bulk alert mode
+ALERT_FEED_URL = "https://www.gdacs.org/gdacsapi/api/events/geteventlist/MAP"
 
-def fetch_weather_data(city, api_key):
+CITIES = ["New York", "Los Angeles", "Miami", "Mumbai", "Pune", "Bangalore", "Hyderabad"]
+
+# Concurrency settings for a refresh (can be overridden from .env)
+MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", 16))
+PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 8))
+REQUEST_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 10))
+
+# Seconds a response is reused when the API sends no caching headers
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", 600))
+ALERTS_CACHE_TTL = int(os.getenv("ALERTS_CACHE_TTL", 900))
+
+# Request quotas (requests/second) kept just under the provider limits
+WEATHERAPI_RATE = float(os.getenv("WEATHERAPI_RATE", 5))
+WEATHERAPI_BURST = float(os.getenv("WEATHERAPI_BURST", 5))
+# GDACS documents no quota, so alert requests are only throttled when this is set (> 0)
+ALERTS_RATE = float(os.getenv("ALERTS_RATE", 0))
+
+# Retries per request (jittered exponential backoff) and re-queue passes per refresh
+RETRY_ATTEMPTS = int(os.getenv("FETCH_RETRY_ATTEMPTS", 4))
+RETRY_MAX_WAIT = float(os.getenv("FETCH_RETRY_MAX_WAIT", 30))
+REQUEUE_ROUNDS = int(os.getenv("FETCH_REQUEUE_ROUNDS", 2))
+REQUEUE_DELAY = float(os.getenv("FETCH_REQUEUE_DELAY", 5))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Alerts published as a single point cover a circle of this radius
+ALERT_POINT_RADIUS_KM = float(os.getenv("ALERT_POINT_RADIUS_KM", 100))
+ALERT_SEVERITY = {"Red": 3, "Orange": 2, "Green": 1}
+NO_ALERT = {"alert_level": "None", "alert_type": "None", "alert_description": ""}
+
+# WeatherAPI response fields (flattened by json_normalize) -> output columns
+WEATHER_FIELDS = {
+    "location.name": "city",
+    "location.localtime": "timestamp",
+    "location.lat": "latitude",
+    "location.lon": "longitude",
+    "current.temp_c": "temperature_c",
+    "current.humidity": "humidity",
+    "current.pressure_mb": "pressure_mb",
+    "current.wind_kph": "wind_speed_kph",
+    "current.condition.text": "weather_condition",
+    "current.precip_mm": "precipitation_mm",
+}
+
+
+class HostLimiter:
+    """Caps the number of in-flight requests to any single host."""
+
+    def __init__(self, limit=PER_HOST_LIMIT):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+        with semaphore:
+            yield
+
+
+def create_session(pool_size=PER_HOST_LIMIT):
+    # One keep-alive connection pool per host, sized for the per-host limit
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get(url, params, session=None, timeout=REQUEST_TIMEOUT, limiter=None, headers=None):
+    http = session or requests
+    with limiter.slot(url) if limiter else nullcontext():
+        return http.get(url, params=params, timeout=timeout, headers=headers)
+
+
+class RetryableHTTPError(requests.exceptions.HTTPError):
+    """Throttled (429) or server-side (5xx) response worth retrying later."""
+
+    def __init__(self, response, retry_after=None):
+        super().__init__(f"{response.status_code} for {response.url}", response=response)
+        self.retry_after = retry_after
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.replace(".", "", 1).isdigit() else None
+
+
+def _bucket_for(url, params):
+    # One bucket per API key and endpoint host; only WeatherAPI requests carry a key.
+    # None when the endpoint is not rate limited.
+    if "key" in params:
+        return get_bucket((urlsplit(url).netloc, params["key"]), WEATHERAPI_RATE, WEATHERAPI_BURST)
+    if ALERTS_RATE > 0:
+        return get_bucket((urlsplit(url).netloc, None), ALERTS_RATE)
+    return None
+
+
+_backoff = wait_random_exponential(multiplier=0.5, max=RETRY_MAX_WAIT)
+
+
+def _retry_wait(retry_state):
+    # Honour Retry-After when the server sends one, otherwise jittered exponential backoff
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after", None)
+    return max(retry_after or 0, _backoff(retry_state))
+
+
+def _is_transient(error):
+    return isinstance(error, (RetryableHTTPError, requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout))
+
+
+def _send(url, params, session, timeout, limiter, headers):
+    bucket = _bucket_for(url, params)
+    if bucket is not None:
+        bucket.acquire()
+    response = _get(url, params, session, timeout, limiter, headers)
+    if response.status_code in RETRY_STATUS:
+        retry_after = _retry_after(response)
+        if response.status_code == 429 and bucket is not None:
+            bucket.pause(retry_after or 1.0)
+        raise RetryableHTTPError(response, retry_after)
+    return response
+
+
+def _get_json(url, params, session=None, timeout=REQUEST_TIMEOUT, limiter=None,
+              cache=None, ttl=0):
+    entry = cache.lookup(url, params) if cache else None
+    if entry and entry.fresh:
+        return entry.body
+    retrying = Retrying(
+        stop=stop_after_attempt(RETRY_ATTEMPTS),
+        wait=_retry_wait,
+        retry=retry_if_exception(_is_transient),
+        reraise=True,
+    )
+    response = retrying(_send, url, params, session, timeout, limiter,
+                        ResponseCache.conditional_headers(entry))
+    if response.status_code == 304:
+        if entry:
+            cache.revalidate(url, params, response.headers, ttl)
+            return entry.body
+        # Nothing cached to reuse (evicted or expired meanwhile): ask again for the full body
+        response = retrying(_send, url, params, session, timeout, limiter, None)
+        if response.status_code == 304:
+            raise requests.exceptions.HTTPError(f"304 without a cached body for {response.url}",
+                                                response=response)
+    response.raise_for_status()
+    body = response.json()
+    if cache:
+        cache.store(url, params, body, response.headers, ttl)
+    return body
+
+
+def _fetch_weather(city, api_key, session=None, timeout=REQUEST_TIMEOUT,
+                   limiter=None, base_url=BASE_URL, cache=None, ttl=WEATHER_CACHE_TTL):
     if not api_key:
         print(f"No API key provided for {city}")
         return None
@@ -23,21 +204,26 @@ def fetch_weather_data(city, api_key):
         "q": city,
         "aqi": "no"
     }
+    weather_json = _get_json(base_url, params, session, timeout, limiter, cache, ttl)
+    print(f"Raw response for {city}: {str(weather_json)[:100]}...")
+    return weather_json
+
+
+def fetch_weather_data(city, api_key, session=None, timeout=REQUEST_TIMEOUT,
+                       limiter=None, base_url=BASE_URL, cache=None):
     try:
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()
-        print(f"Raw response for {city}: {str(response.json())[:100]}...")
-        return response.json()
+        return _fetch_weather(city, api_key, session, timeout, limiter, base_url, cache)
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data for {city}: {e}")
         return None
 
 # New function for public alerts
-def fetch_public_alerts(city, api_url="https://www.gdacs.org/API/v1/alerts"):
+def fetch_public_alerts(city, api_url=ALERTS_URL, session=None, timeout=REQUEST_TIMEOUT,
+                        limiter=None, cache=None):
     try:
-        response = requests.get(api_url, params={"location": city})
-        response.raise_for_status()
-        alerts = response.json().get("alerts", [])
+        alerts_json = _get_json(api_url, {"location": city}, session, timeout, limiter,
+                                cache, ALERTS_CACHE_TTL)
+        alerts = alerts_json.get("alerts", [])
         if alerts:
             # Extract key info from the first active alert
             alert = alerts[0]
@@ -46,68 +232,423 @@ def fetch_public_alerts(city, api_url="https://www.gdacs.org/API/v1/alerts"):
                 "alert_type": alert.get("eventtype", "Unknown"),
                 "alert_description": alert.get("description", "")
             }
-        return {"alert_level": "None", "alert_type": "None", "alert_description": ""}
+        return dict(NO_ALERT)
     except Exception as e:
         print(f"Error fetching alerts for {city}: {e}")
-        return {"alert_level": "None", "alert_type": "None", "alert_description": ""}
+        return dict(NO_ALERT)
+
+
+def fetch_alert_feed(api_url=ALERT_FEED_URL, session=None, timeout=REQUEST_TIMEOUT,
+                     limiter=None, cache=None):
+    try:
+        return _get_json(api_url, {}, session, timeout, limiter, cache, ALERTS_CACHE_TTL)
+    except Exception as e:
+        print(f"Error fetching alert feed: {e}")
+        return None
+
+
+def _circles(lon, lat, radius_km, n_vertices=32):
+    # Vectorized circle polygons with longitude scaled by cos(latitude)
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radius_deg = radius_km / 111.32
+    lat_r = lat[:, None] + radius_deg * np.sin(angles)
+    lon_r = lon[:, None] + radius_deg * np.cos(angles) / np.maximum(np.cos(np.radians(lat))[:, None], 1e-6)
+    return shapely.polygons(np.stack([lon_r, lat_r], axis=-1))
+
+
+def alert_footprints(feed, point_radius_km=ALERT_POINT_RADIUS_KM):
+    """
+    Parse a GDACS GeoJSON event feed into a GeoDataFrame with one footprint per alert.
+
+    Polygon features are used as-is; point-only events get a circle of `point_radius_km`.
+    """
+    columns = ["event_id", "alert_level", "alert_type", "alert_description"]
+    features = (feed or {}).get("features") or []
+    if not features:
+        return gpd.GeoDataFrame(columns=columns, geometry=[], crs="EPSG:4326")
+    raw = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    raw = raw[raw.geometry.notna()]
+    props = raw.reindex(columns=["eventid", "alertlevel", "eventtype", "description", "name"])
+    footprints = gpd.GeoDataFrame({
+        "event_id": props["eventid"].astype(str).where(props["eventid"].notna(), raw.index.astype(str)),
+        "alert_level": props["alertlevel"].fillna("Unknown").astype(str),
+        "alert_type": props["eventtype"].fillna("Unknown").astype(str),
+        "alert_description": props["description"].fillna(props["name"]).fillna("").astype(str),
+    }, geometry=raw.geometry.values, crs="EPSG:4326")
+    points = footprints.geom_type == "Point"
+    if points.any():
+        footprints.loc[points, "geometry"] = _circles(
+            footprints.geometry[points].x.to_numpy(),
+            footprints.geometry[points].y.to_numpy(),
+            point_radius_km,
+        )
+    return footprints.reset_index(drop=True)
+
+
+def join_alerts(df, footprints):
+    """
+    Match every row of `df` (latitude/longitude) to all alerts whose footprint covers it
+    through a spatial index join, keeping the most severe level and every alert type.
+    """
+    df = df.assign(**NO_ALERT, alert_count=0)
+    if footprints.empty or df.empty:
+        return df
+    points = gpd.GeoDataFrame(
+        {"row": np.arange(len(df))},
+        geometry=gpd.points_from_xy(df["longitude"], df["latitude"]),
+        crs="EPSG:4326",
+    )
+    joined = gpd.sjoin(points, footprints, how="inner", predicate="intersects")
+    joined = joined.drop_duplicates(["row", "event_id"])
+    if joined.empty:
+        return df
+    joined["severity"] = joined["alert_level"].map(ALERT_SEVERITY).fillna(0)
+    joined = joined.sort_values(["row", "severity"], ascending=[True, False])
+    matched = joined.groupby("row").agg(
+        alert_level=("alert_level", "first"),
+        alert_type=("alert_type", lambda s: ";".join(dict.fromkeys(s))),
+        alert_description=("alert_description", lambda s: " | ".join(d for d in s if d)),
+        alert_count=("event_id", "size"),
+    )
+    positions = matched.index.to_numpy()
+    for column in matched.columns:
+        df.iloc[positions, df.columns.get_loc(column)] = matched[column].to_numpy()
+    return df
+
+
+def _fetch_weather_queued(executor, queries, api_key, session, timeout, limiter, base_url,
+                          cache, requeue_rounds, ttl=WEATHER_CACHE_TTL):
+    # Weather for every query, re-queueing the ones that failed transiently
+    weather = {}
+    pending = list(queries)
+    for round_number in range(requeue_rounds + 1):
+        futures = {
+            query: executor.submit(_fetch_weather, query, api_key, session, timeout, limiter,
+                                   base_url, cache, ttl)
+            for query in pending
+        }
+        failed = []
+        for query, future in futures.items():
+            try:
+                weather[query] = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching data for {query}: {e}")
+                weather[query] = None
+                if _is_transient(e):
+                    failed.append(query)
+        if not failed or round_number == requeue_rounds:
+            if failed:
+                print(f"Giving up on {len(failed)} cities after {requeue_rounds} re-queues: {failed}")
+            break
+        print(f"Re-queueing {len(failed)} cities in {REQUEUE_DELAY:g}s...")
+        time.sleep(REQUEUE_DELAY)
+        pending = failed
+    return weather
+
+
+def fetch_all_cities(cities, api_key, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT,
+                     timeout=REQUEST_TIMEOUT, base_url=BASE_URL, alerts_url=ALERTS_URL,
+                     cache=None, alert_mode="per-city", requeue_rounds=REQUEUE_ROUNDS):
+    """
+    Fetch weather and alerts for every city concurrently over one pooled session,
+    so a refresh takes about as long as the slowest request.
+
+    Args:
+        cities: List of city names
+        api_key: WeatherAPI key
+        max_workers: Size of the thread pool (1 walks the cities serially)
+        per_host_limit: Maximum concurrent requests to each API host
+        timeout: Per-request timeout in seconds
+        base_url, alerts_url: Endpoints, overridable to point at a stub server
+        cache: Optional ResponseCache consulted before every request
+        alert_mode: "per-city" calls the alerts API for each city; "bulk" skips it and
+            leaves the alerts to be joined from the global feed (see join_alerts)
+        requeue_rounds: Extra passes over cities whose weather request still failed
+            with a transient error (throttling, 5xx, timeouts) after its retries
+
+    Returns:
+        List of (city, weather_json, alerts) tuples in the order of `cities`
+    """
+    print(f"Fetching data for {len(cities)} cities ({max_workers} workers, "
+          f"{per_host_limit} per host)...")
+    limiter = HostLimiter(per_host_limit)
+    with create_session(per_host_limit) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        alert_futures = {}
+        if alert_mode != "bulk":
+            alert_futures = {
+                city: executor.submit(fetch_public_alerts, city, alerts_url, session, timeout,
+                                      limiter, cache)
+                for city in cities
+            }
+        weather = _fetch_weather_queued(executor, cities, api_key, session, timeout, limiter,
+                                        base_url, cache, requeue_rounds)
+        return [
+            (city, weather[city],
+             alert_futures[city].result() if city in alert_futures else dict(NO_ALERT))
+            for city in cities
+        ]
+
+
+def fetch_grid_observations(cities_df, api_key, distance_km=GRID_DISTANCE_KM,
+                            precision=GRID_PRECISION, max_workers=MAX_WORKERS,
+                            per_host_limit=PER_HOST_LIMIT, timeout=REQUEST_TIMEOUT,
+                            base_url=BASE_URL, cache=None, requeue_rounds=REQUEUE_ROUNDS,
+                            n_directions=8):
+    """
+    Observed weather on a ring of points around each city (see weather_grid.sample_grid).
+
+    Nearby cities whose sample points fall in the same geohash cell share one request,
+    and cell responses are cached for GRID_CACHE_TTL seconds.
+    """
+    def fetch(queries):
+        limiter = HostLimiter(per_host_limit)
+        with create_session(per_host_limit) as session, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return _fetch_weather_queued(executor, queries, api_key, session, timeout, limiter,
+                                         base_url, cache, requeue_rounds, GRID_CACHE_TTL)
+
+    return sample_grid(cities_df, fetch, distance_km, compass_directions(n_directions), precision)
+
+
+def load_cities(file_path):
+    with open(file_path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
 
 # Update preprocess_weather_data to include alerts
-def preprocess_weather_data(weather_json, alerts):
+def weather_record(weather_json, alerts):
     if not weather_json or "error" in weather_json:
         print(f"Invalid JSON or error in response: {weather_json}")
         return None
     
-    data = {
+    precipitation = weather_json["current"]["precip_mm"]
+    return {
         "city": weather_json["location"]["name"],
         "timestamp": weather_json["location"]["localtime"],
         "latitude": weather_json["location"]["lat"],
         "longitude": weather_json["location"]["lon"],
         "temperature_c": weather_json["current"]["temp_c"],
-        "humidity": weather_json["current"]["humidity"],
+        "humidity": weather_json["current"]["humidity"] / 100,
         "pressure_mb": weather_json["current"]["pressure_mb"],
         "wind_speed_kph": weather_json["current"]["wind_kph"],
         "weather_condition": weather_json["current"]["condition"]["text"],
-        "precipitation_mm": weather_json["current"]["precip_mm"],
+        "precipitation_mm": precipitation if precipitation is not None else 0.0,
         "alert_level": alerts["alert_level"],
         "alert_type": alerts["alert_type"],
         "alert_description": alerts["alert_description"]
     }
-    
-    df = pd.DataFrame([data])
-    
+
+
+def preprocess_weather_data(weather_json, alerts):
+    record = weather_record(weather_json, alerts)
+    if record is None:
+        return None
+    return pd.DataFrame([record])
+
+
+def preprocess_weather_batch(entries):
+    """
+    Vectorized preprocessing of a whole refresh.
+
+    Args:
+        entries: List of {"city", "weather", "alerts"} dicts (raw API responses)
+
+    Returns:
+        DataFrame with the same columns as preprocess_weather_data, one row per valid response
+    """
+    valid = [e for e in entries if e.get("weather") and "error" not in e["weather"]]
+    if len(valid) < len(entries):
+        print(f"Skipping {len(entries) - len(valid)} invalid or empty responses")
+    columns = list(WEATHER_FIELDS.values()) + list(NO_ALERT)
+    if not valid:
+        return pd.DataFrame(columns=columns)
+    weather = pd.json_normalize([e["weather"] for e in valid])
+    weather = weather.reindex(columns=list(WEATHER_FIELDS)).rename(columns=WEATHER_FIELDS)
+    alerts = pd.DataFrame.from_records([e.get("alerts") or NO_ALERT for e in valid])
+    df = pd.concat([weather, alerts.reindex(columns=list(NO_ALERT))], axis=1)
     df["humidity"] = df["humidity"] / 100
     df["precipitation_mm"] = df["precipitation_mm"].fillna(0)
-    
+    return df[columns]
+
+
+def normalize_temperature(df, stats=None, update_stats=True):
+    """
+    z-score temperature_c once over the finished batch. The reading in degrees C is kept
+    as temperature_raw_c for rules with absolute thresholds (see cluster_risk_zones).
+
+    With a RunningStats store the batch is first folded into the persisted statistics and
+    normalized against them, so values stay comparable between refreshes.
+    """
+    df["temperature_raw_c"] = df["temperature_c"]
+    if stats is not None:
+        if update_stats:
+            stats.update(df, ["temperature_c"])
+        if "temperature_c" in stats.features:
+            df["temperature_c"] = stats.normalize(df, ["temperature_c"])[:, 0]
+        return df
+    if len(df) > 1:
+        df["temperature_c"] = (
+            df["temperature_c"] - df["temperature_c"].mean()
+        ) / df["temperature_c"].std()
     return df
 
-def main():
-    cities = ["New York", "Los Angeles", "Miami", "Mumbai", "Pune", "Bangalore", "Hyderabad"]
-    all_data = pd.DataFrame()
-    
-    for city in cities:
-        print(f"Fetching data for {city}...")
-        weather_json = fetch_weather_data(city, API_KEY)
-        alerts = fetch_public_alerts(city)  # Fetch public alerts for the city
-        if weather_json:
-            df = preprocess_weather_data(weather_json, alerts)
-            if df is not None:
-                print(f"Data for {city}:\n{df.to_string()}\n")
-                all_data = pd.concat([all_data, df], ignore_index=True)
-    
-    if not all_data.empty:
-        print(f"Combined DataFrame:\n{all_data.to_string()}\n")
-        if len(all_data) > 1:
-            all_data["temperature_c"] = (
-                all_data["temperature_c"] - all_data["temperature_c"].mean()
-            ) / all_data["temperature_c"].std()
-        output_file = "preprocessed_weather_data.csv"
-        try:
-            all_data.to_csv(output_file, index=False)
-            print(f"Data saved to {output_file}")
-        except PermissionError as e:
-            print(f"PermissionError: {e}. Try saving to a different file or running as administrator.")
-    else:
+
+def write_parquet_dataset(df, root_path, refreshed_at=None):
+    """
+    Append one refresh to a Parquet dataset partitioned by refresh date.
+
+    Every refresh becomes its own file, so earlier refreshes on the same day are kept.
+    """
+    refreshed_at = refreshed_at or datetime.utcnow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(
+        "refresh_date", pa.array([refreshed_at.strftime("%Y-%m-%d")] * len(df), pa.string())
+    )
+    pq.write_to_dataset(
+        table,
+        root_path,
+        partition_cols=["refresh_date"],
+        basename_template=f"weather-{refreshed_at.strftime('%H%M%S%f')}-{{i}}.parquet",
+    )
+    print(f"Parquet partition written to {root_path}")
+
+def build_weather_frame(entries, alert_feed=None, stats=None, update_stats=True):
+    all_data = normalize_temperature(preprocess_weather_batch(entries), stats, update_stats)
+    if alert_feed is not None:
+        footprints = alert_footprints(alert_feed)
+        print(f"Loaded {len(footprints)} alert footprints from the global feed")
+        all_data = join_alerts(all_data, footprints)
+    return all_data
+
+
+def save_weather_data(all_data, output_file="preprocessed_weather_data.csv", parquet_dir=None,
+                      refreshed_at=None):
+    if all_data.empty:
         print("No data to save.")
+        return
+    if refreshed_at is not None:
+        # Identifies the fetch, so later stages can tell a new batch from a rerun or a replay
+        all_data = all_data.assign(refreshed_at=refreshed_at.isoformat())
+    print(f"Combined DataFrame:\n{all_data.to_string()}\n")
+    if parquet_dir:
+        write_parquet_dataset(all_data, parquet_dir, refreshed_at)
+    try:
+        all_data.to_csv(output_file, index=False)
+        print(f"Data saved to {output_file}")
+    except PermissionError as e:
+        print(f"PermissionError: {e}. Try saving to a different file or running as administrator.")
+
+
+def replay_archive(path, output_file="preprocessed_weather_data.csv", parquet_dir=None, stats=None):
+    """
+    Rebuild the preprocessed output from an archived refresh without calling any API.
+
+    A RunningStats store is only read, so replays never change the live statistics.
+    """
+    header, entries = read_archive(path)
+    print(f"Replaying {len(entries)} archived responses from {path}")
+    all_data = build_weather_frame(entries, header.get("alert_feed"), stats, update_stats=False)
+    save_weather_data(all_data, output_file, parquet_dir, header["refreshed_at"])
+    return all_data
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch and preprocess weather and alert data")
+    parser.add_argument("--cities-file", help="Text file with one city per line (default: built-in list)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="Concurrent requests per refresh (1 fetches serially)")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT,
+                        help="Maximum concurrent requests to one API host")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT,
+                        help="Per-request timeout in seconds")
+    parser.add_argument("--parquet-dir",
+                        help="Also append the refresh to a date-partitioned Parquet dataset")
+    parser.add_argument("--cache-path", default=None,
+                        help="Response cache database (default: .cache/http_cache.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the APIs")
+    parser.add_argument("--requeue-rounds", type=int, default=REQUEUE_ROUNDS,
+                        help="Extra passes over cities that failed with throttling/5xx/timeouts")
+    parser.add_argument("--alert-mode", choices=["per-city", "bulk"], default="per-city",
+                        help="bulk: one global GDACS feed request matched to cities spatially")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR,
+                        help="Directory for the compressed raw-response archive of each refresh")
+    parser.add_argument("--no-archive", action="store_true", help="Do not archive raw responses")
+    parser.add_argument("--replay", metavar="ARCHIVE",
+                        help="Rebuild the output offline from an archive file ('latest' for the newest)")
+    parser.add_argument("--output", default="preprocessed_weather_data.csv", help="Output CSV file")
+    parser.add_argument("--grid", action="store_true",
+                        help="Also sample weather on a ring of points around each city")
+    parser.add_argument("--grid-distance-km", type=float, default=GRID_DISTANCE_KM,
+                        help="Radius of the sampling ring")
+    parser.add_argument("--grid-directions", type=int, default=8,
+                        help="Number of evenly spaced bearings sampled around each city")
+    parser.add_argument("--grid-precision", type=int, default=GRID_PRECISION,
+                        help="Geohash precision used to share cells between nearby cities")
+    parser.add_argument("--grid-output", default="weather_grid_observations.csv",
+                        help="Output CSV for the grid observations")
+    parser.add_argument("--stats-path", default=os.path.join(STATS_DIR, "ingest_stats.json"),
+                        help="Running statistics used to normalize temperature_c across refreshes")
+    parser.add_argument("--stats-decay", type=float, default=STATS_DECAY,
+                        help="Weight kept by past refreshes on every update (1.0 = no forgetting)")
+    parser.add_argument("--batch-stats", action="store_true",
+                        help="Normalize over the current batch only, ignoring the running statistics")
+    parser.add_argument("--history-dir", default=HISTORY_DIR,
+                        help="Per-city ring buffer of past refreshes (rolling-window risk features)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Do not append this refresh to the history store")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stats = None if args.batch_stats else RunningStats.load(args.stats_path, args.stats_decay)
+    if args.replay:
+        path = latest_archive(args.archive_dir) if args.replay == "latest" else args.replay
+        if not path:
+            print(f"No archives found in {args.archive_dir}")
+            return 1
+        replay_archive(path, args.output, args.parquet_dir, stats)
+        return
+
+    cities = load_cities(args.cities_file) if args.cities_file else CITIES
+    refreshed_at = datetime.utcnow()
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_path) if args.cache_path else ResponseCache()
+    results = fetch_all_cities(cities, API_KEY, max_workers=args.workers,
+                               per_host_limit=args.per_host, timeout=args.timeout, cache=cache,
+                               alert_mode=args.alert_mode, requeue_rounds=args.requeue_rounds)
+    alert_feed = None
+    if args.alert_mode == "bulk":
+        alert_feed = fetch_alert_feed(timeout=args.timeout, cache=cache) or {}
+
+    entries = [
+        {"city": city, "weather": weather_json, "alerts": alerts}
+        for city, weather_json, alerts in results
+        if weather_json
+    ]
+    if entries and not args.no_archive:
+        write_archive(entries, args.archive_dir, refreshed_at, alert_feed)
+    all_data = build_weather_frame(entries, alert_feed, stats)
+    if stats is not None and not all_data.empty:
+        stats.save()
+    save_weather_data(all_data, args.output, args.parquet_dir, refreshed_at)
+    if not args.no_history and not all_data.empty:
+        WeatherHistory(args.history_dir).append(all_data, refreshed_at)
+
+    if args.grid and not all_data.empty:
+        grid = fetch_grid_observations(all_data, API_KEY, args.grid_distance_km, args.grid_precision,
+                                       max_workers=args.workers, per_host_limit=args.per_host,
+                                       timeout=args.timeout, cache=cache,
+                                       requeue_rounds=args.requeue_rounds,
+                                       n_directions=args.grid_directions)
+        grid.to_csv(args.grid_output, index=False)
+        print(f"Grid observations saved to {args.grid_output}")
+    if cache:
+        print(f"Response cache: {cache.stats()}")
+        cache.close()
+    # Non-zero when no city was fetched, so a pipeline run stops instead of reusing old data
+    return 1 if all_data.empty else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
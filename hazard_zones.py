@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely import STRtree
+
+
+# Weight factor for edges crossing a hazard without its own `penalty`; inf blocks them
+HAZARD_PENALTY = float(os.getenv("HAZARD_PENALTY", "inf"))
+
+
+def prepare_hazards(hazards, default_penalty=HAZARD_PENALTY):
+    """
+    Hazard footprints (flood extents, cyclone cones, ...) as a GeoDataFrame in EPSG:4326.
+
+    Every polygon gets a `penalty`: the factor applied to the weight of each edge that
+    crosses it, inf to block the edge. Penalties below 1 are raised to 1, so hazards only
+    make routes longer and precomputed lower bounds (ALT landmarks) stay valid.
+    """
+    hazards = hazards[hazards.geometry.notna() & ~hazards.geometry.is_empty]
+    if hazards.crs is not None:
+        hazards = hazards.to_crs("EPSG:4326")
+    penalty = pd.to_numeric(hazards['penalty'], errors='coerce') if 'penalty' in hazards else pd.Series(np.nan, index=hazards.index)
+    return hazards.assign(penalty=np.maximum(penalty.fillna(default_penalty).to_numpy(dtype=float), 1.0))
+
+
+def load_hazards(file_path, default_penalty=HAZARD_PENALTY):
+    """Hazard polygons from any file geopandas reads, prepared by `prepare_hazards`."""
+    hazards = prepare_hazards(gpd.read_file(file_path), default_penalty)
+    print(f"✅ Loaded {len(hazards)} hazard polygons from {file_path}")
+    return hazards
+
+
+def hazard_weight(weight, factor):
+    """Penalized weight of a networkx edge; None hides a blocked edge from networkx's shortest paths."""
+    return None if np.isinf(factor) else weight * factor
+
+
+class HazardIndex:
+    """
+    STRtree over the straight segments of a routing graph's edges.
+
+    All hazard polygons are matched against it in one bulk query, so the cost grows with
+    the number of (polygon, edge) hits instead of polygons x edges.
+    """
+
+    def __init__(self, segments, edge_segment=None):
+        self.segments = segments
+        # Segment of every edge; the two directions of a road share one
+        self.edge_segment = np.arange(len(segments)) if edge_segment is None else edge_segment
+        self.tree = STRtree(segments)
+
+    @classmethod
+    def from_coordinates(cls, lon1, lat1, lon2, lat2, edge_segment=None):
+        starts = np.column_stack([lon1, lat1])
+        ends = np.column_stack([lon2, lat2])
+        return cls(shapely.linestrings(np.stack([starts, ends], axis=1)), edge_segment)
+
+    @classmethod
+    def for_network(cls, network):
+        """Index over the edges of a RoadNetwork (CSR order)."""
+        u = np.repeat(np.arange(network.n_nodes), np.diff(network.indptr))
+        v = np.asarray(network.indices, dtype=np.int64)
+        pairs, edge_segment = np.unique(np.column_stack([np.minimum(u, v), np.maximum(u, v)]),
+                                        axis=0, return_inverse=True)
+        lon, lat = np.asarray(network.lon), np.asarray(network.lat)
+        return cls.from_coordinates(lon[pairs[:, 0]], lat[pairs[:, 0]], lon[pairs[:, 1]], lat[pairs[:, 1]],
+                                    edge_segment.ravel())
+
+    def penalties(self, hazards):
+        """(edges,) weight factor: the largest penalty of the hazards an edge crosses, 1 elsewhere."""
+        factor = np.ones(len(self.segments))
+        if len(hazards):
+            polygon, segment = self.tree.query(hazards.geometry.to_numpy(), predicate='intersects')
+            np.maximum.at(factor, segment, hazards['penalty'].to_numpy(dtype=float)[polygon])
+        return factor[self.edge_segment]
+
+
+def penalize_network(network, hazards, index=None):
+    """
+    RoadNetwork sharing `network`'s arrays but with hazard-penalized weights.
+
+    Returns:
+        (network, factor) with the (edges,) factor from HazardIndex.penalties
+    """
+    factor = (index or HazardIndex.for_network(network)).penalties(hazards)
+    print(f"✅ Hazards touch {int((factor > 1).sum())} road edges, {int(np.isinf(factor).sum())} blocked")
+    return network.with_weights(np.asarray(network.weights) * factor), factor
+
+
+def penalize_graph(G, hazards):
+    """
+    Penalize or block, in place, the edges of a networkx graph with `pos` node coordinates
+    that cross hazards. The unpenalized weight is kept as `base_weight`, so calling this
+    again with new hazards replaces the previous penalties.
+    """
+    edges = list(G.edges(data=True))
+    if not edges:
+        return G
+    start = np.array([G.nodes[a]['pos'] for a, _, _ in edges], dtype=float)
+    end = np.array([G.nodes[b]['pos'] for _, b, _ in edges], dtype=float)
+    factor = HazardIndex.from_coordinates(start[:, 0], start[:, 1], end[:, 0], end[:, 1]).penalties(hazards)
+    for (_, _, data), f in zip(edges, factor.tolist()):
+        base = data.setdefault('base_weight', data['weight'])
+        data['hazard'] = f
+        data['weight'] = hazard_weight(base, f)
+    print(f"✅ Hazards touch {int((factor > 1).sum())} graph edges, {int(np.isinf(factor).sum())} blocked")
+    return G
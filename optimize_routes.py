@@ -85,11 +85,32 @@
 
 
 
+import argparse
+import os
+import time
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 import networkx as nx
 from shapely.geometry import LineString
+from sklearn.neighbors import BallTree
+from road_network import ROAD_CACHE_DIR, ROAD_WEIGHT, _haversine_m, load_road_network
+from alt_routing import ALTIndex, load_alt_index
+from route_repair import RouteRepair, read_weight_updates
+from hazard_zones import HazardIndex, load_hazards, penalize_graph, penalize_network
+
+
+# Safe zones each city is linked to in the straight-line graph, besides its own
+SAFE_ZONE_CANDIDATES = int(os.getenv("SAFE_ZONE_CANDIDATES", 3))
+# Cities routed per batched Dijkstra; each batch holds (chunk x road nodes) distances and predecessors
+ROAD_ROUTE_CHUNK = int(os.getenv("ROAD_ROUTE_CHUNK", 64))
+# Floor of the risk multiplier; risk scores are z-scored, so risk + 1 can be zero or negative
+MIN_RISK_MULTIPLIER = 0.1
+
+
+def risk_multiplier(risk):
+    """Edge weight factor for a city's risk score: risk + 1, kept strictly positive for Dijkstra."""
+    return np.maximum(np.asarray(risk, dtype=float) + 1, MIN_RISK_MULTIPLIER)
 
 
 def load_clustered_data(file_path):
@@ -108,43 +129,85 @@ def load_safe_zones(file_path):
         return None
 
 
-def build_dynamic_graph(df, safe_zones):
-    G = nx.Graph()
-    
+def build_dynamic_graph(df, safe_zones, k_nearest=SAFE_ZONE_CANDIDATES):
+    """
+    Directed city -> safe zone graph. Every city links to its own SafeZone_{city} and to its
+    `k_nearest` safe zones (BallTree on the haversine metric, O(n log n)), weighted by
+    great-circle km x risk_multiplier(risk), with all weights computed in one array operation.
+
+    The k-nearest edges only matter to searches that may end at any zone
+    (find_nearest_zone_routes, the routing service); find_evacuation_routes always takes
+    the direct edge to SafeZone_{city}, so pass k_nearest=0 for it.
+    """
+    G = nx.DiGraph()
+    cities = df['city'].astype(str).to_numpy()
+    city_lon, city_lat = df['longitude'].to_numpy(dtype=float), df['latitude'].to_numpy(dtype=float)
+    risk = df['risk_score'].to_numpy(dtype=float)
+    zone_ids = safe_zones['safe_zone_id'].astype(str).to_numpy()
+    zone_lon = safe_zones['longitude'].to_numpy(dtype=float)
+    zone_lat = safe_zones['latitude'].to_numpy(dtype=float)
+    parents = safe_zones['city'] if 'city' in safe_zones else pd.Series('Unknown', index=safe_zones.index)
+
     # Add city nodes
-    for _, row in df.iterrows():
-        G.add_node(row['city'], 
-                   pos=(row['longitude'], row['latitude']), 
-                   risk=row['risk_score'],
-                   type='city')
-    
+    G.add_nodes_from((city, {'pos': (lon, lat), 'risk': r, 'type': 'city'})
+                     for city, lon, lat, r in zip(cities, city_lon, city_lat, risk))
+
     # Add safe zone nodes
-    for _, row in safe_zones.iterrows():
-        G.add_node(row['safe_zone_id'], 
-                   pos=(row['longitude'], row['latitude']), 
-                   risk=row['risk_score'],
-                   type='safe_zone',
-                   parent_city=row.get('city', 'Unknown'))
-    
-    cities = df['city'].tolist()
-    
-    # Connect each city to its safe zone
-    for city in cities:
-        city_safe_zone = f"SafeZone_{city}"
-        if city_safe_zone in G.nodes():
-            pos_city = G.nodes[city]['pos']
-            pos_safe = G.nodes[city_safe_zone]['pos']
-            dist = np.linalg.norm(np.array(pos_city) - np.array(pos_safe))
-            risk_weight = G.nodes[city]['risk'] + 1
-            G.add_edge(city, city_safe_zone, weight=dist * risk_weight)
-            print(f"✅ Connected {city} → {city_safe_zone}")
-        else:
-            print(f"❌ Safe zone {city_safe_zone} not found!")
-    
+    G.add_nodes_from((zone, {'pos': (lon, lat), 'risk': r, 'type': 'safe_zone', 'parent_city': parent})
+                     for zone, lon, lat, r, parent in zip(zone_ids, zone_lon, zone_lat,
+                                                          safe_zones['risk_score'], parents))
+
+    # Candidate zones: the k nearest by great-circle distance
+    k = min(k_nearest, len(zone_ids))
+    rows = np.empty(0, dtype=np.int64)
+    cols = np.empty(0, dtype=np.int64)
+    if k > 0:
+        tree = BallTree(np.radians(np.column_stack([zone_lat, zone_lon])), metric='haversine')
+        nearest = tree.query(np.radians(np.column_stack([city_lat, city_lon])), k=k, return_distance=False)
+        rows, cols = np.repeat(np.arange(len(cities)), k), nearest.ravel()
+
+    # Plus each city's own safe zone
+    zone_row = pd.Series(np.arange(len(zone_ids)), index=zone_ids)
+    zone_row = zone_row[~zone_row.index.duplicated()]
+    own = zone_row.reindex("SafeZone_" + cities).to_numpy()
+    for city in cities[np.isnan(own)]:
+        print(f"❌ Safe zone SafeZone_{city} not found!")
+    has_own = ~np.isnan(own)
+    rows = np.concatenate([rows, np.flatnonzero(has_own)])
+    cols = np.concatenate([cols, own[has_own].astype(np.int64)])
+    rows, cols = np.unique(np.column_stack([rows, cols]), axis=0).T
+
+    km = _haversine_m(city_lon[rows], city_lat[rows], zone_lon[cols], zone_lat[cols]) / 1000.0
+    weights = km * risk_multiplier(risk[rows])
+    G.add_edges_from((city, zone, {'weight': w, 'distance_km': d}) for city, zone, w, d in
+                     zip(cities[rows].tolist(), zone_ids[cols].tolist(), weights.tolist(), km.tolist()))
+    print(f"✅ Connected {len(cities)} cities to their own and {k} nearest safe zones")
+
     print(f"\n📊 Graph: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges\n")
     return G
 
 
+def find_nearest_zone_routes(G, cities):
+    """Route every city to its nearest safe zone with one multi-source Dijkstra from all safe zones."""
+    zones = [node for node, kind in G.nodes(data='type') if kind == 'safe_zone']
+    if not zones:
+        print("❌ No safe zones in graph")
+        return {}, {}
+    # Searching from the zones over the reversed graph covers every node in one pass
+    reverse = G.reverse(copy=False) if G.is_directed() else G
+    _, paths = nx.multi_source_dijkstra(reverse, zones, weight='weight')
+    routes, destinations = {}, {}
+    for city in cities:
+        if city not in paths:
+            print(f"❌ No safe zone reachable from {city}")
+            continue
+        path = paths[city][::-1]
+        routes[city] = LineString([G.nodes[node]['pos'] for node in path])
+        destinations[city] = path[-1]
+        print(f"✅ Route for {city} → {path[-1]}: {len(path)} nodes")
+    return routes, destinations
+
+
 def find_evacuation_routes(G, cities):
     routes = {}
     for city in cities:
@@ -167,7 +230,112 @@ def find_evacuation_routes(G, cities):
     return routes
 
 
-def save_routes_to_geojson(routes, output_file):
+def find_nearest_zone_road_routes(network, df, safe_zones):
+    """
+    Route every city to the nearest safe zone by road with a single multi-source search;
+    returns (routes, destinations) keyed by city.
+    """
+    zone_nodes = network.nearest_nodes(safe_zones['longitude'].to_numpy(), safe_zones['latitude'].to_numpy())
+    # First safe zone snapped to each road node
+    zone_at = dict(zip(zone_nodes[::-1].tolist(), safe_zones['safe_zone_id'].tolist()[::-1]))
+    zone_rows = dict(zip(safe_zones['safe_zone_id'], range(len(safe_zones))))
+    tree = network.evacuation_tree(zone_nodes)
+    sources = network.nearest_nodes(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+    routes, destinations = {}, {}
+    for i, city in enumerate(df['city']):
+        path = tree.route(sources[i])
+        if path is None:
+            print(f"❌ No safe zone reachable by road from {city}")
+            continue
+        zone_id = zone_at[path[-1]]
+        zone = safe_zones.iloc[zone_rows[zone_id]]
+        coords = ([(df['longitude'].iloc[i], df['latitude'].iloc[i])] + network.coordinates(path)
+                  + [(zone['longitude'], zone['latitude'])])
+        routes[city] = LineString(coords)
+        destinations[city] = zone_id
+        print(f"✅ Road route for {city} → {zone_id}: {len(path)} nodes, {tree.distances[sources[i]]:.0f} {network.meta.get('weight', '')}")
+    return routes, destinations
+
+
+def repair_road_routes(network, df, safe_zones, updates_file=None, hazards=None):
+    """
+    Apply changed or blocked road edges (CSV of u, v, weight) and/or hazard polygons to the
+    persisted nearest-zone evacuation tree and return (routes, destinations) for the cities
+    whose route changed; a city that can no longer reach any safe zone maps to None.
+    """
+    zone_nodes = network.nearest_nodes(safe_zones['longitude'].to_numpy(), safe_zones['latitude'].to_numpy())
+    repair = RouteRepair.open(network, zone_nodes, safe_zones['safe_zone_id'].tolist())
+    start = time.perf_counter()
+    changed = {}
+    if hazards is not None:
+        changed.update(repair.apply_hazards(HazardIndex.for_network(network).penalties(hazards)))
+    if updates_file:
+        u, v, weights = read_weight_updates(updates_file, network)
+        positions = repair.edge_positions(u, v)
+        if (positions < 0).any():
+            print(f"❌ Skipping {int((positions < 0).sum())} updates for edges not in the road network")
+        for node, old in repair.apply(positions[positions >= 0], weights[positions >= 0]).items():
+            changed.setdefault(node, old)
+    sources = network.nearest_nodes(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+    # A freshly built tree has no previous routes to compare against
+    rows = range(len(df)) if repair.built else repair.changed_sources(sources, changed)
+    print(f"✅ Repaired evacuation tree in {(time.perf_counter() - start) * 1000:.1f} ms: "
+          f"{len(changed)} road nodes changed, {len(rows)} routes affected")
+    zone_rows = dict(zip(safe_zones['safe_zone_id'], range(len(safe_zones))))
+    routes, destinations = {}, {}
+    for i in rows:
+        city = df['city'].iloc[i]
+        path = repair.route(sources[i])
+        if path is None:
+            print(f"❌ No safe zone reachable by road from {city}")
+            routes[city] = None
+            continue
+        zone_id = repair.zones[path[-1]]
+        zone = safe_zones.iloc[zone_rows[zone_id]]
+        coords = ([(df['longitude'].iloc[i], df['latitude'].iloc[i])] + network.coordinates(path)
+                  + [(zone['longitude'], zone['latitude'])])
+        routes[city] = LineString(coords)
+        destinations[city] = zone_id
+        print(f"✅ Rerouted {city} → {zone_id}: {len(path)} nodes, {repair.distances[sources[i]]:.0f} {network.meta.get('weight', '')}")
+    return routes, destinations
+
+
+def find_road_routes(network, df, safe_zones, alt_index=None):
+    """
+    Route every city to its safe zone over a RoadNetwork, both snapped to their nearest road node.
+
+    With an ALTIndex each route is a landmark A* query; otherwise one Dijkstra runs per city,
+    ROAD_ROUTE_CHUNK cities at a time so memory does not grow with the number of cities.
+    """
+    safe_zones = safe_zones.set_index('city') if 'city' in safe_zones else safe_zones.set_index('safe_zone_id')
+    for city in set(df['city'].tolist()) - set(safe_zones.index):
+        print(f"❌ No safe zone for {city}")
+    df = df[df['city'].isin(safe_zones.index)]
+    zones = safe_zones.loc[df['city']]
+    sources = network.nearest_nodes(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+    targets = network.nearest_nodes(zones['longitude'].to_numpy(), zones['latitude'].to_numpy())
+    routes = {}
+    for i, city in enumerate(df['city']):
+        if alt_index is not None:
+            distance, path = alt_index.query(sources[i], targets[i])
+        else:
+            row = i % ROAD_ROUTE_CHUNK
+            if row == 0:
+                distances, predecessors = network.shortest_paths(sources[i:i + ROAD_ROUTE_CHUNK])
+            distance = distances[row, targets[i]]
+            path = network.route(sources[i], targets[i], predecessors[row])
+        if path is None:
+            print(f"❌ No road route for {city}")
+            continue
+        # Start at the city and end at the safe zone, not only at the snapped road nodes
+        coords = ([(df['longitude'].iloc[i], df['latitude'].iloc[i])] + network.coordinates(path)
+                  + [(zones['longitude'].iloc[i], zones['latitude'].iloc[i])])
+        routes[city] = LineString(coords)
+        print(f"✅ Road route for {city}: {len(path)} nodes, {distance:.0f} {network.meta.get('weight', '')}")
+    return routes
+
+
+def save_routes_to_geojson(routes, output_file, destinations=None):
     if not routes:
         print("❌ No routes to save!")
         return
@@ -176,13 +344,63 @@ def save_routes_to_geojson(routes, output_file):
         'city': list(routes.keys()),
         'geometry': list(routes.values())
     }, crs='EPSG:4326')
+    if destinations:
+        gdf['safe_zone_id'] = gdf['city'].map(destinations)
     
     gdf.to_file(output_file, driver='GeoJSON')
     print(f"\n✅ Saved {len(gdf)} routes to {output_file}")
     print(f"Routes saved for cities: {gdf['city'].tolist()}\n")
 
 
-def main():
+def update_routes_geojson(routes, output_file, destinations=None):
+    """Replace the routes of the given cities in an existing routes file; None drops a city's route."""
+    if not os.path.exists(output_file):
+        save_routes_to_geojson({city: line for city, line in routes.items() if line is not None},
+                               output_file, destinations)
+        return
+    gdf = gpd.read_file(output_file)
+    gdf = gdf[~gdf['city'].isin(list(routes))]
+    changed = gpd.GeoDataFrame({
+        'city': [city for city, line in routes.items() if line is not None],
+        'geometry': [line for line in routes.values() if line is not None]
+    }, crs='EPSG:4326')
+    if destinations:
+        changed['safe_zone_id'] = changed['city'].map(destinations)
+    gdf = pd.concat([gdf, changed], ignore_index=True)
+    gdf.to_file(output_file, driver='GeoJSON')
+    print(f"✅ Updated {len(routes)} routes in {output_file}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate evacuation routes from cities to their safe zones")
+    parser.add_argument("--road-network",
+                        help="Local road network (.graphml, .osm or .osm.pbf) to route over instead of straight lines")
+    parser.add_argument("--road-cache-dir", default=ROAD_CACHE_DIR,
+                        help="Where the converted CSR arrays of the road network are cached")
+    parser.add_argument("--road-weight", default=ROAD_WEIGHT,
+                        help="Edge attribute used as the routing cost (e.g. length or travel_time)")
+    parser.add_argument("--alt-landmarks", type=int,
+                        help="Answer road routes with ALT A* over this many landmarks (built once and cached)")
+    parser.add_argument("--nearest-zone", action="store_true",
+                        help="Route every city to its nearest safe zone with one multi-source search")
+    parser.add_argument("--candidates", type=int, default=SAFE_ZONE_CANDIDATES,
+                        help="Nearest safe zones linked to every city in the straight-line graph "
+                             "(used with --nearest-zone)")
+    parser.add_argument("--weight-updates", metavar="CSV",
+                        help="Changed road edges (columns u, v, weight; empty or inf blocks the edge): repair "
+                             "the saved nearest-zone tree and write only the routes that changed")
+    parser.add_argument("--changed-output", default="changed_evacuation_routes.geojson")
+    parser.add_argument("--hazards",
+                        help="Hazard polygons (GeoJSON, shapefile, ...) whose crossing edges are penalized by "
+                             "their `penalty` column or blocked")
+    parser.add_argument("--repair", action="store_true",
+                        help="With --road-network, repair the saved nearest-zone tree for --hazards and/or "
+                             "--weight-updates and write only the routes that changed")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     print("="*60)
     print("GENERATING EVACUATION ROUTES")
     print("="*60 + "\n")
@@ -194,9 +412,57 @@ def main():
         print("❌ No safe zones! Run cluster_risk_zones.py first.")
         return
     
-    G = build_dynamic_graph(df, safe_zones)
-    routes = find_evacuation_routes(G, df['city'].tolist())
-    save_routes_to_geojson(routes, 'dynamic_evacuation_routes.geojson')
+    if args.road_network:
+        try:
+            network = load_road_network(args.road_network, args.road_cache_dir, args.road_weight)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"❌ Could not load road network: {e}")
+            return
+    hazards = None
+    if args.hazards:
+        try:
+            hazards = load_hazards(args.hazards)
+        except Exception as e:
+            print(f"❌ Could not load hazards: {e}")
+            return
+    repair = args.repair or args.weight_updates
+    if repair and not args.road_network:
+        print("❌ --repair and --weight-updates need --road-network")
+        return
+    if repair:
+        try:
+            routes, destinations = repair_road_routes(network, df, safe_zones, args.weight_updates, hazards)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"❌ Could not apply weight updates: {e}")
+            return
+        if routes:
+            save_routes_to_geojson(routes, args.changed_output, destinations)
+            update_routes_geojson(routes, 'dynamic_evacuation_routes.geojson', destinations)
+        else:
+            print("✅ No routes changed")
+        return
+    destinations = None
+    if args.road_network:
+        alt_index = load_alt_index(network, args.alt_landmarks) if args.alt_landmarks and not args.nearest_zone else None
+        if hazards is not None:
+            network, _ = penalize_network(network, hazards)
+            if alt_index is not None:
+                # Hazards only raise weights, so landmark bounds from the base network still hold
+                alt_index = ALTIndex(network, alt_index.landmarks, alt_index.from_landmarks, alt_index.to_landmarks)
+    if args.road_network and args.nearest_zone:
+        routes, destinations = find_nearest_zone_road_routes(network, df, safe_zones)
+    elif args.road_network:
+        routes = find_road_routes(network, df, safe_zones, alt_index)
+    else:
+        # Without --nearest-zone every city routes to its own zone, so extra candidates are unused
+        G = build_dynamic_graph(df, safe_zones, args.candidates if args.nearest_zone else 0)
+        if hazards is not None:
+            penalize_graph(G, hazards)
+        if args.nearest_zone:
+            routes, destinations = find_nearest_zone_routes(G, df['city'].tolist())
+        else:
+            routes = find_evacuation_routes(G, df['city'].tolist())
+    save_routes_to_geojson(routes, 'dynamic_evacuation_routes.geojson', destinations)
     
     print("="*60)
     print("✅ DONE! Run dashboard.py to visualize routes")
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+# Seconds between automatic refreshes
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", 1800))
+STAGE_TIMEOUT = int(os.getenv("PIPELINE_STAGE_TIMEOUT", 900))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))
+PIPELINE_STAGES = ["fetch_weather_data.py", "cluster_risk_zones.py", "optimize_routes.py"]
+# Layers the dashboard reads; every run must rewrite all of them to be published
+SNAPSHOT_FILES = ["clustered_risk_zones.geojson", "safe_zones.geojson", "dynamic_evacuation_routes.geojson"]
+# Stage outputs that must also be new, so layers rebuilt from an old fetch are not published
+FRESH_FILES = ["preprocessed_weather_data.csv"] + SNAPSHOT_FILES
+CURRENT_FILE = "CURRENT"
+
+
+class PipelineRefresher:
+    """
+    Runs the fetch -> cluster -> route pipeline in a background thread and publishes its
+    output layers as an immutable snapshot directory.
+
+    Every stage runs as a subprocess of the current interpreter in `work_dir`. After the
+    last stage, the layers are copied to `<snapshot_dir>/<stamp>/`, and the `CURRENT`
+    pointer file is replaced atomically. Readers therefore see either the previous
+    complete snapshot or the new one, never a half-written pipeline run. A run that
+    leaves any layer older than its own start fails instead of republishing leftovers.
+    """
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, work_dir=".", stages=None, interval=REFRESH_INTERVAL,
+                 keep=SNAPSHOT_KEEP):
+        self.snapshot_dir = os.path.join(work_dir, snapshot_dir)
+        self.work_dir = work_dir
+        self.stages = stages or [[os.path.join(os.path.dirname(os.path.abspath(__file__)), stage)]
+                                 for stage in PIPELINE_STAGES]
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_attempt = 0.0
+        self._status = {"running": False, "stage": None, "started_at": None, "last_error": None,
+                        "last_success": None}
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def current(self):
+        """Directory of the latest complete snapshot, or None before the first one."""
+        try:
+            with open(os.path.join(self.snapshot_dir, CURRENT_FILE), encoding="utf-8") as f:
+                path = os.path.join(self.snapshot_dir, f.read().strip())
+        except OSError:
+            return None
+        return path if os.path.isdir(path) else None
+
+    def as_of(self):
+        """When the data on display was produced: the current snapshot, else the newest layer in `work_dir`."""
+        snapshot = self.current()
+        if snapshot:
+            with open(os.path.join(snapshot, "meta.json"), encoding="utf-8") as f:
+                return datetime.fromisoformat(json.load(f)["completed_at"])
+        mtimes = [os.path.getmtime(os.path.join(self.work_dir, name)) for name in SNAPSHOT_FILES
+                  if os.path.exists(os.path.join(self.work_dir, name))]
+        return datetime.fromtimestamp(max(mtimes)) if mtimes else None
+
+    def trigger(self):
+        """Start a refresh in the background; returns False if one is already running."""
+        with self._lock:
+            if self._status["running"]:
+                return False
+            self._status.update(running=True, stage=None, started_at=datetime.now().isoformat(timespec="seconds"))
+            self._last_attempt = time.time()
+            self._thread = threading.Thread(target=self._run, name="pipeline-refresh", daemon=True)
+            self._thread.start()
+            return True
+
+    def maybe_refresh(self):
+        """
+        Trigger a refresh when the displayed data is older than `interval` seconds; a failed
+        run is retried after another `interval`, not on every call.
+        """
+        if time.time() - self._last_attempt < self.interval:
+            return False
+        as_of = self.as_of()
+        if as_of is None or time.time() - as_of.timestamp() > self.interval:
+            return self.trigger()
+        return False
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        # Whole seconds, so filesystems with coarse mtimes still count this run's files as new
+        started = int(time.time())
+        try:
+            for stage in self.stages:
+                name = os.path.basename(stage[0])
+                with self._lock:
+                    self._status["stage"] = name
+                result = subprocess.run([sys.executable] + stage, cwd=self.work_dir, capture_output=True,
+                                        text=True, timeout=STAGE_TIMEOUT)
+                if result.returncode != 0:
+                    raise RuntimeError(f"{name} exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+            snapshot = self._publish(started)
+            with self._lock:
+                self._status.update(last_success=datetime.now().isoformat(timespec="seconds"), last_error=None)
+            print(f"✅ Pipeline refreshed: {snapshot}")
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            with self._lock:
+                self._status["last_error"] = str(e)
+            print(f"❌ Pipeline refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._status.update(running=False, stage=None)
+
+    def _publish(self, started):
+        stale = [name for name in FRESH_FILES if not os.path.exists(os.path.join(self.work_dir, name))
+                 or os.path.getmtime(os.path.join(self.work_dir, name)) < started]
+        if stale:
+            raise RuntimeError(f"Pipeline did not write {', '.join(stale)}")
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        tmp_dir = os.path.join(self.snapshot_dir, f"{stamp}.tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in SNAPSHOT_FILES:
+            shutil.copy2(os.path.join(self.work_dir, name), tmp_dir)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"completed_at": datetime.now().isoformat(timespec="seconds"), "files": SNAPSHOT_FILES}, f)
+        os.replace(tmp_dir, os.path.join(self.snapshot_dir, stamp))
+        pointer = os.path.join(self.snapshot_dir, CURRENT_FILE)
+        with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+            f.write(stamp)
+        os.replace(f"{pointer}.tmp", pointer)
+        self._prune(stamp)
+        return os.path.join(self.snapshot_dir, stamp)
+
+    def _prune(self, current):
+        # Keep the newest snapshots; a reader may still be loading the previous one
+        snapshots = sorted(name for name in os.listdir(self.snapshot_dir)
+                           if os.path.isdir(os.path.join(self.snapshot_dir, name)) and not name.endswith(".tmp"))
+        for name in snapshots[:-self.keep]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.snapshot_dir, name), ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the fetch -> cluster -> route pipeline and publish a snapshot")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--loop", action="store_true", help="Keep refreshing every --interval seconds")
+    parser.add_argument("--interval", type=int, default=REFRESH_INTERVAL)
+    parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP, help="Snapshots to keep")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    refresher = PipelineRefresher(args.snapshot_dir, interval=args.interval, keep=max(1, args.keep))
+    while True:
+        refresher.trigger()
+        refresher.wait()
+        if not args.loop:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+
+DEFAULT_RESOURCES = {'ambulances': 20, 'shelters': 10, 'rescue_teams': 15}
+ALLOCATION_METHODS = ['apportion', 'lp']
+
+
+def _per_region(value, n, default):
+    # Scalar or per-region array -> float array of length n
+    if value is None:
+        return np.full(n, default, dtype=float)
+    return np.broadcast_to(np.asarray(value, dtype=float), (n,)).astype(float)
+
+
+def _capped_quotas(weights, total, caps):
+    # Water-filling: quota = min(cap, level * weight), with the level found after one sort
+    quotas = np.zeros_like(weights)
+    positive = (weights > 0) & (caps > 0)
+    if positive.any() and total > 0:
+        w, c = weights[positive], caps[positive]
+        order = np.argsort(c / w)
+        ratios, w, c = (c / w)[order], w[order], c[order]
+        capped_before = np.concatenate([[0.0], np.cumsum(c)[:-1]])
+        weight_after = np.cumsum(w[::-1])[::-1]
+        # Units handed out if the level stopped at each region's saturation point
+        handed_out = capped_before + ratios * weight_after
+        k = np.searchsorted(handed_out, total)
+        if k < len(ratios):
+            level = (total - capped_before[k]) / weight_after[k]
+            c = np.minimum(c, level * w)
+        quotas[np.flatnonzero(positive)[order]] = c
+    # Zero-weight regions only take what the weighted ones cannot hold
+    rest = (weights <= 0) & (caps > 0)
+    leftover = total - quotas.sum()
+    if leftover > 1e-9 and rest.any():
+        quotas[rest] = _capped_quotas(np.ones(rest.sum()), leftover, caps[rest])
+    return quotas
+
+
+def apportion(weights, total, caps=None, minimums=None):
+    """
+    Largest-remainder apportionment of an integer `total` over regions.
+
+    Every region first gets its minimum, the rest is shared in proportion to `weights`
+    without exceeding `caps`, and the units left after flooring go to the largest
+    fractional remainders. The result sums to exactly min(total, caps.sum()).
+
+    Args:
+        weights: (n,) non-negative priorities
+        total: Units available
+        caps: Optional scalar or (n,) maximum per region
+        minimums: Optional scalar or (n,) minimum coverage per region; if the minimums
+            alone exceed `total`, `total` is apportioned over them instead
+
+    Returns:
+        (n,) int array
+    """
+    weights = np.clip(np.asarray(weights, dtype=float), 0, None)
+    n = len(weights)
+    total = int(total)
+    caps = np.floor(_per_region(caps, n, np.inf))
+    minimums = np.minimum(np.floor(_per_region(minimums, n, 0.0)), caps)
+    if minimums.sum() > total:
+        return apportion(minimums, total, caps=minimums)
+    total = min(total, caps.sum())
+    quotas = minimums + _capped_quotas(weights, total - minimums.sum(), caps - minimums)
+    allocation = np.floor(quotas + 1e-9)
+    leftover = int(round(total - allocation.sum()))
+    if leftover > 0:
+        # Stable sort: ties go to the earlier region
+        remainders = np.where(allocation < caps, quotas - allocation, -1.0)
+        allocation[np.argsort(-remainders, kind='stable')[:leftover]] += 1
+    return allocation.astype(int)
+
+
+def optimize_allocation(weights, supply, caps=None, minimums=None, demand=None, travel_cost=None):
+    """
+    Allocate every resource type at once with a linear program (HiGHS).
+
+    Every region has a proportional target, the largest-remainder `apportion` of the
+    units to deploy. The LP minimizes travel_cost * x plus weights * |x - target|
+    subject to deploying min(supply, total upper bound) units of each resource and
+    minimums <= x <= min(caps, demand) per region. Without travel costs this is the
+    proportional split. With them, a unit only moves away from its target when the
+    travel saved outweighs the priority-weighted deviation, so the units never pile
+    up in a single region. Each variable is in one total row and one target row
+    (totally unimodular), and the targets are integral, so the simplex vertex is
+    already integral and no branch-and-bound is needed.
+
+    Args:
+        weights: (n,) region priorities
+        supply: {resource: units available}
+        caps, minimums, demand: Optional {resource: scalar or (n,) array}
+        travel_cost: Optional (n,) cost per unit delivered, in the same units as `weights`
+
+    Returns:
+        {resource: (n,) int array}
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    caps, minimums, demand = caps or {}, minimums or {}, demand or {}
+    travel_cost = _per_region(travel_cost, n, 0.0)
+    deviation_cost = np.clip(weights, 0, None)
+    resources = list(supply)
+    lower, upper, totals, targets = [], [], [], []
+    for resource in resources:
+        lb = _per_region(minimums.get(resource), n, 0.0)
+        ub = np.minimum(_per_region(caps.get(resource), n, np.inf), _per_region(demand.get(resource), n, np.inf))
+        ub = np.maximum(ub, lb)
+        if lb.sum() > supply[resource]:
+            raise ValueError(f"Minimum coverage for {resource} needs {lb.sum():.0f} units, "
+                             f"only {supply[resource]} available")
+        lower.append(lb)
+        upper.append(ub)
+        totals.append(min(supply[resource], ub.sum()))
+        targets.append(apportion(weights, totals[-1], ub, lb))
+    m = len(resources) * n
+    # Variables: x, then excess and shortfall against the targets, x - excess + shortfall = target.
+    # One row per resource sums its block of x.
+    A_total = sparse.kron(sparse.eye(len(resources), format='csr'), np.ones((1, n)), format='csr')
+    A_total = sparse.hstack([A_total, sparse.csr_matrix((len(resources), 2 * m))])
+    eye = sparse.eye(m, format='csr')
+    A_target = sparse.hstack([eye, -eye, eye])
+    bounds = np.column_stack([
+        np.concatenate(lower + [np.zeros(2 * m)]),
+        np.concatenate(upper + [np.full(2 * m, np.inf)]),
+    ])
+    # HiGHS presolve scales badly on this structure and buys nothing, so skip it
+    result = linprog(
+        np.concatenate([np.tile(travel_cost, len(resources)), np.tile(deviation_cost, 2 * len(resources))]),
+        A_eq=sparse.vstack([A_total, A_target], format='csr'), b_eq=np.concatenate([totals] + targets),
+        bounds=bounds, method='highs', options={'presolve': False},
+    )
+    if not result.success:
+        raise RuntimeError(f"Allocation LP failed: {result.message}")
+    x = np.round(result.x[:m]).astype(int).reshape(len(resources), n)
+    return dict(zip(resources, x))
+
+
+def allocate(weights, supply, method='apportion', caps=None, minimums=None, demand=None, travel_cost=None):
+    """Allocate each resource in `supply` over regions; returns a DataFrame with one int column per resource."""
+    if method == 'lp':
+        allocation = optimize_allocation(weights, supply, caps, minimums, demand, travel_cost)
+    elif method == 'apportion':
+        caps, minimums, demand = caps or {}, minimums or {}, demand or {}
+        allocation = {}
+        for resource, total in supply.items():
+            cap = caps.get(resource)
+            if demand.get(resource) is not None:
+                cap = np.minimum(_per_region(cap, len(weights), np.inf), _per_region(demand[resource], len(weights), np.inf))
+            allocation[resource] = apportion(weights, total, cap, minimums.get(resource))
+    else:
+        raise ValueError(f"Unknown allocation method: {method}")
+    return pd.DataFrame(allocation)
+
+
+def benchmark(n_regions=10000, n_resources=5, method='apportion', repeat=3, seed=42):
+    """Time a full re-allocation over random regions; returns the best wall time in seconds."""
+    rng = np.random.default_rng(seed)
+    weights = rng.integers(1, 4, n_regions).astype(float)
+    supply = {f"resource_{i}": int(rng.integers(n_regions, 10 * n_regions)) for i in range(n_resources)}
+    caps = {resource: rng.integers(1, 30, n_regions) for resource in supply}
+    minimums = {resource: 1 for resource in supply}
+    travel_cost = rng.random(n_regions)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = allocate(weights, supply, method, caps, minimums, travel_cost=travel_cost)
+        best = min(best, time.perf_counter() - start)
+    exact = all(result[r].sum() == min(supply[r], caps[r].sum()) for r in supply)
+    print(f"{method}: {n_regions} regions x {n_resources} resources in {best * 1000:.1f} ms "
+          f"(totals exact: {exact})")
+    return best
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the resource allocation engine")
+    parser.add_argument("--regions", type=int, default=10000)
+    parser.add_argument("--resources", type=int, default=5)
+    parser.add_argument("--method", choices=ALLOCATION_METHODS, default='apportion')
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    benchmark(args.regions, args.resources, args.method, args.repeat)
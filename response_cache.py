@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+
+CACHE_PATH = os.getenv("HTTP_CACHE_PATH", os.path.join(".cache", "http_cache.sqlite"))
+CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Query parameters that identify the caller rather than the resource
+IGNORED_PARAMS = ("key",)
+
+CacheEntry = namedtuple("CacheEntry", ["body", "etag", "last_modified", "fresh"])
+
+
+def cache_key(endpoint, params):
+    query = sorted((k, str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMS)
+    return hashlib.sha256(json.dumps([endpoint, query]).encode("utf-8")).hexdigest()
+
+
+def response_ttl(headers, default_ttl):
+    """
+    Seconds a response may be served from cache, taken from Cache-Control / Expires
+    when the API sends them and `default_ttl` otherwise.
+    """
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        name = name.lower()
+        if name in ("no-store", "no-cache"):
+            return 0
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return max(0, parsedate_to_datetime(expires).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+    return default_ttl
+
+
+class ResponseCache:
+    """
+    Persistent, size-bounded LRU cache of JSON API responses keyed on (endpoint, query).
+
+    Stale entries are kept while they have an ETag or Last-Modified validator so the
+    next request can be made conditional and answered with a 304.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, endpoint TEXT, body TEXT, etag TEXT, last_modified TEXT,"
+            " expires_at REAL, size INTEGER, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.commit()
+
+    def lookup(self, endpoint, params):
+        key = cache_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            body, etag, last_modified, expires_at = row
+            fresh = expires_at > now
+            self.counters["hits" if fresh else "misses"] += 1
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return CacheEntry(json.loads(body), etag, last_modified, fresh)
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def store(self, endpoint, params, body, headers, default_ttl):
+        ttl = response_ttl(headers, default_ttl)
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if ttl <= 0 and not (etag or last_modified):
+            return
+        payload = json.dumps(body)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(endpoint, params), endpoint, payload, etag, last_modified,
+                 now + ttl, len(payload), now),
+            )
+            self.counters["stores"] += 1
+            self._evict()
+            self._conn.commit()
+
+    def revalidate(self, endpoint, params, headers, default_ttl):
+        """Extend a stale entry after the server answered 304 Not Modified."""
+        ttl = response_ttl(headers, default_ttl)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET expires_at = ?, last_access = ? WHERE key = ?",
+                (now + ttl, now, cache_key(endpoint, params)),
+            )
+            self.counters["revalidated"] += 1
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self.counters["evictions"] += len(evicted)
+
+    def stats(self):
+        """Counters for this session plus lifetime totals and current cache size."""
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM counters"))
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "lifetime": {name: totals.get(name, 0) + value for name, value in self.counters.items()},
+        }
+
+    def close(self):
+        # Fold this session's counters into the lifetime totals
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO counters VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(self.counters.items()),
+            )
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,135 @@
+import os
+from datetime import datetime
+import joblib
+import numpy as np
+from weather_history import HISTORY_FEATURES
+
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_PREFIX = "risk_model"
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+RISK_LEVELS = ['Low', 'Medium', 'High']
+RISK_FEATURES = ['temperature_c', 'humidity', 'wind_speed_kph', 'precipitation_mm']
+RISK_WEIGHTS = [0.4, 0.2, 0.2, 0.2]
+CLUSTER_FEATURES = ['risk_score'] + RISK_FEATURES
+# Already z-scored at ingest (fetch_weather_data.normalize_temperature), so scored as they are
+PRENORMALIZED_FEATURES = ['temperature_c']
+# Extra weights when rolling history features (accumulated rain, falling pressure) are used
+HISTORY_WEIGHTS = [0.1, 0.15, 0.15]
+
+
+def risk_features(use_history=False):
+    """(features, weights) behind the composite risk score."""
+    if use_history:
+        return RISK_FEATURES + HISTORY_FEATURES, RISK_WEIGHTS + HISTORY_WEIGHTS
+    return RISK_FEATURES, RISK_WEIGHTS
+
+
+class RiskModel:
+    """
+    Fitted risk scoring artifact: feature scaling, score weights, cluster centroids and
+    the centroid -> risk level map.
+
+    Scoring is pure NumPy (standardize, dot with the weights, nearest centroid), so it
+    needs neither sklearn nor a refit and costs a few microseconds per row.
+    """
+
+    def __init__(self, mean, scale, weights, centroids, level_map, features=RISK_FEATURES,
+                 cluster_features=CLUSTER_FEATURES, version=None, n_train=0):
+        self.features = list(features)
+        self.cluster_features = list(cluster_features)
+        self.mean = np.asarray(mean, dtype=float)
+        scale = np.asarray(scale, dtype=float)
+        self.scale = np.where(scale == 0, 1.0, scale)
+        self.weights = np.asarray(weights, dtype=float)
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.level_map = {int(k): v for k, v in level_map.items()}
+        # Raw feature columns that follow risk_score in the clustering input
+        self.cluster_columns = [self.features.index(f) for f in self.cluster_features[1:]]
+        self.levels = np.array([self.level_map.get(i) for i in range(len(self.centroids))], dtype=object)
+        self.level_index = np.array([RISK_LEVELS.index(level) for level in self.levels])
+        self.version = version or datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        self.n_train = n_train
+
+    def to_dict(self):
+        return {
+            "version": self.version, "n_train": self.n_train,
+            "features": self.features, "cluster_features": self.cluster_features,
+            "mean": self.mean, "scale": self.scale, "weights": self.weights,
+            "centroids": self.centroids, "level_map": self.level_map,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["mean"], data["scale"], data["weights"], data["centroids"], data["level_map"],
+                   data["features"], data["cluster_features"], data["version"], data.get("n_train", 0))
+
+    def score_array(self, X):
+        """
+        Score a raw (n, len(features)) array.
+
+        Returns:
+            (risk_score, risk_zone) arrays
+        """
+        X = np.nan_to_num(np.asarray(X, dtype=float))
+        risk_score = ((X - self.mean) / self.scale) @ self.weights
+        # Clustering runs on [risk_score, raw features]; nearest centroid via the expanded
+        # squared distance avoids materialising an (n, k, d) difference array
+        Z = np.column_stack([risk_score, X[:, self.cluster_columns]])
+        distances = (Z * Z).sum(axis=1)[:, None] - 2 * Z @ self.centroids.T \
+            + (self.centroids * self.centroids).sum(axis=1)[None, :]
+        return risk_score, distances.argmin(axis=1)
+
+    def score(self, df):
+        """Return a copy of `df` with risk_score, risk_zone and risk_level assigned."""
+        risk_score, risk_zone = self.score_array(df[self.features].to_numpy(dtype=float))
+        df = df.copy()
+        df['risk_score'] = risk_score
+        df['risk_zone'] = risk_zone
+        df['risk_level'] = self.levels[risk_zone]
+        return df
+
+
+def _latest_pointer(model_dir):
+    return os.path.join(model_dir, f"{MODEL_PREFIX}-latest.txt")
+
+
+def save_risk_model(model, model_dir=MODEL_DIR):
+    """Write `model_dir/risk_model-<version>.joblib` and point risk_model-latest.txt at it."""
+    os.makedirs(model_dir, exist_ok=True)
+    file_name = f"{MODEL_PREFIX}-{model.version}.joblib"
+    path = os.path.join(model_dir, file_name)
+    joblib.dump(model.to_dict(), path)
+    pointer = _latest_pointer(model_dir)
+    with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+        f.write(file_name)
+    os.replace(f"{pointer}.tmp", pointer)
+    print(f"Risk model {model.version} saved to {path}")
+    return path
+
+
+def latest_risk_model(model_dir=MODEL_DIR):
+    pointer = _latest_pointer(model_dir)
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, encoding="utf-8") as f:
+        return os.path.join(model_dir, f.read().strip())
+
+
+_loaded = {}
+
+
+def load_risk_model(path=None, model_dir=MODEL_DIR):
+    """Load an artifact (the latest one by default); each file is read from disk once per process."""
+    path = path or latest_risk_model(model_dir)
+    if path is None or not os.path.exists(path):
+        raise FileNotFoundError(f"No risk model found in {model_dir}; run cluster_risk_zones.py first")
+    if path not in _loaded:
+        _loaded[path] = RiskModel.from_dict(joblib.load(path))
+    return _loaded[path]
+
+
+def score(df, model=None):
+    """Assign risk_score/risk_level to new observations with a persisted model (no refit)."""
+    return (model or load_risk_model()).score(df)
@@ -0,0 +1,141 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from risk_model import MODEL_DIR, RISK_LEVELS, RiskModel, load_risk_model
+from weather_history import HISTORY_DIR, HISTORY_FEATURES, WeatherHistory, add_history_features
+
+
+SIMULATION_SAMPLES = int(os.getenv("SIMULATION_SAMPLES", 2000))
+SIMULATION_CHUNK = int(os.getenv("SIMULATION_CHUNK", 250))
+# Forecast uncertainty per feature, in units of the model's feature scale (std)
+FORECAST_SIGMA = {'temperature_c': 0.25, 'humidity': 0.25, 'wind_speed_kph': 0.25, 'precipitation_mm': 0.25}
+# Physical bounds applied after perturbing
+FEATURE_BOUNDS = {'humidity': (0.0, 1.0), 'wind_speed_kph': (0.0, None), 'precipitation_mm': (0.0, None)}
+
+_worker_model = None
+
+
+def _init_worker(model_state):
+    # Each worker rebuilds the model once instead of unpickling it with every chunk
+    global _worker_model
+    _worker_model = RiskModel.from_dict(model_state)
+
+
+def _simulate_chunk(X, sigma, lower, upper, n_samples, seed):
+    """
+    Score `n_samples` perturbed copies of the (cities, features) array `X` in one batch.
+
+    Returns:
+        (risk_scores, level_counts) with shapes (n_samples, cities) and (cities, levels)
+    """
+    rng = np.random.default_rng(seed)
+    samples = X[None, :, :] + rng.standard_normal((n_samples,) + X.shape) * sigma
+    samples = np.clip(samples, lower, upper)
+    risk_score, risk_zone = _worker_model.score_array(samples.reshape(-1, X.shape[1]))
+    level = _worker_model.level_index[risk_zone].reshape(n_samples, -1)
+    cells = np.arange(X.shape[0]) * len(RISK_LEVELS) + level
+    counts = np.bincount(cells.ravel(), minlength=X.shape[0] * len(RISK_LEVELS)).reshape(X.shape[0], -1)
+    return risk_score.reshape(n_samples, -1).astype(np.float32), counts
+
+
+def simulate_risk(df, model, n_samples=SIMULATION_SAMPLES, sigma=None, workers=None,
+                  chunk_size=SIMULATION_CHUNK, ci=90.0, seed=42):
+    """
+    Monte Carlo risk scenarios: perturb each city's weather features and rescore.
+
+    Samples are split into chunks, each seeded from one SeedSequence so results do
+    not depend on the number of workers, and the chunks are spread over a process pool.
+
+    Args:
+        df: Observations with the model's features (one row per city)
+        model: RiskModel from risk_model.load_risk_model
+        n_samples: Scenarios per city
+        sigma: Optional {feature: std in units of the feature's scale}, over FORECAST_SIGMA
+        workers: Processes (default: all cores; 1 runs in-process)
+        chunk_size: Scenarios per task
+        ci: Central confidence interval width in percent
+
+    Returns:
+        DataFrame with one row per city: deterministic and mean risk_score, the CI bounds,
+        the probability of every risk level and the most likely level
+    """
+    sigma = {**FORECAST_SIGMA, **(sigma or {})}
+    X = np.nan_to_num(df[model.features].to_numpy(dtype=float))
+    scale = np.array([sigma.get(f, 0.0) for f in model.features]) * model.scale
+    bounds = [FEATURE_BOUNDS.get(f, (None, None)) for f in model.features]
+    lower = np.array([-np.inf if low is None else low for low, _ in bounds])
+    upper = np.array([np.inf if high is None else high for _, high in bounds])
+    sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = workers or os.cpu_count() or 1
+    tasks = [(X, scale, lower, upper, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    if workers == 1:
+        _init_worker(model.to_dict())
+        results = [_simulate_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model.to_dict(),)) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*tasks)))
+    scores = np.concatenate([result[0] for result in results])
+    counts = sum(result[1] for result in results)
+    probabilities = counts / n_samples
+    tail = (100.0 - ci) / 2
+    low, high = np.percentile(scores, [tail, 100.0 - tail], axis=0)
+    summary = pd.DataFrame({
+        'city': df['city'].to_numpy(),
+        'risk_score': model.score_array(X)[0],
+        'risk_score_mean': scores.mean(axis=0),
+        f'risk_score_p{tail:g}': low,
+        f'risk_score_p{100.0 - tail:g}': high,
+    })
+    for i, level in enumerate(RISK_LEVELS):
+        summary[f'p_{level.lower()}'] = probabilities[:, i]
+    summary['likely_level'] = np.array(RISK_LEVELS)[probabilities.argmax(axis=1)]
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo risk scenarios with the saved risk model")
+    parser.add_argument("--input", default="preprocessed_weather_data.csv")
+    parser.add_argument("--output", default="risk_simulation.csv")
+    parser.add_argument("--model", help="Risk model artifact (default: latest in --model-dir)")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--samples", type=int, default=SIMULATION_SAMPLES)
+    parser.add_argument("--chunk-size", type=int, default=SIMULATION_CHUNK)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--sigma", type=float,
+                        help="Uncertainty for every feature, in units of its scale (default 0.25)")
+    parser.add_argument("--ci", type=float, default=90.0, help="Confidence interval width in percent")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        model = load_risk_model(args.model, args.model_dir)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return
+    try:
+        df = pd.read_csv(args.input)
+    except FileNotFoundError:
+        print(f"Error: {args.input} not found")
+        return
+    if set(HISTORY_FEATURES) & set(model.features) - set(df.columns):
+        df = add_history_features(df, WeatherHistory(args.history_dir))
+    sigma = {f: args.sigma for f in model.features} if args.sigma is not None else None
+    start = time.perf_counter()
+    summary = simulate_risk(df, model, args.samples, sigma, args.workers, args.chunk_size, args.ci, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {args.samples} scenarios for {len(df)} cities in {elapsed:.2f} s")
+    summary.to_csv(args.output, index=False)
+    print(f"Simulation results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
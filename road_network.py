@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+
+ROAD_CACHE_DIR = os.getenv("ROAD_CACHE_DIR", os.path.join(".cache", "road_network"))
+ROAD_WEIGHT = os.getenv("ROAD_WEIGHT", "length")
+EARTH_RADIUS_M = 6371008.8
+# csgraph drops explicit zeros from sparse input, so zero-length edges get this weight
+MIN_EDGE_WEIGHT = 1e-6
+CSR_ARRAYS = ["indptr", "indices", "weights", "node_ids", "lon", "lat"]
+
+
+def _haversine_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _unit_vectors(lon, lat):
+    # Points on the unit sphere, so Euclidean nearest neighbours are great-circle nearest
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def read_graph(path):
+    """Read a road graph from GraphML, OSM XML (.osm/.xml) or .osm.pbf, without network access."""
+    # osmnx is imported here only: it takes seconds and cache hits never need it
+    lower = path.lower()
+    if lower.endswith(".graphml"):
+        import osmnx as ox
+        return ox.load_graphml(path)
+    if lower.endswith((".osm", ".xml", ".osm.bz2")):
+        import osmnx as ox
+        return ox.graph_from_xml(path, simplify=True, retain_all=True)
+    if lower.endswith(".pbf"):
+        try:
+            from pyrosm import OSM
+        except ImportError:
+            raise RuntimeError(
+                f"Reading {path} needs pyrosm (pip install pyrosm); alternatively convert it "
+                "to .osm with osmium and pass that file"
+            )
+        osm = OSM(path)
+        nodes, edges = osm.get_network(nodes=True, network_type="driving")
+        return osm.to_graph(nodes, edges, graph_type="networkx")
+    raise ValueError(f"Unsupported road network format: {path} (expected .graphml, .osm or .osm.pbf)")
+
+
+def graph_to_arrays(G, weight=ROAD_WEIGHT):
+    """Directed CSR arrays for a (Multi)DiGraph with x/y node coordinates; parallel edges keep the lightest."""
+    node_ids = np.array(list(G.nodes), dtype=np.int64)
+    position = {node: i for i, node in enumerate(G.nodes)}
+    lon = np.array([G.nodes[node]["x"] for node in G.nodes], dtype=float)
+    lat = np.array([G.nodes[node]["y"] for node in G.nodes], dtype=float)
+    edges = list(G.edges(data=weight))
+    u = np.array([position[a] for a, _, _ in edges], dtype=np.int64)
+    v = np.array([position[b] for _, b, _ in edges], dtype=np.int64)
+    w = np.array([np.nan if value is None else float(value) for _, _, value in edges], dtype=float)
+    if not G.is_directed():
+        u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+    missing = np.isnan(w)
+    w[missing] = _haversine_m(lon[u[missing]], lat[u[missing]], lon[v[missing]], lat[v[missing]])
+    w = np.maximum(w, MIN_EDGE_WEIGHT)
+    # Sort by (u, v, w) and keep the first edge of every (u, v) pair
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    first = np.concatenate([[True], (u[1:] != u[:-1]) | (v[1:] != v[:-1])])
+    u, v, w = u[first], v[first], w[first]
+    indptr = np.searchsorted(u, np.arange(len(node_ids) + 1)).astype(np.int64)
+    return {"indptr": indptr, "indices": v.astype(np.int32), "weights": w,
+            "node_ids": node_ids, "lon": lon, "lat": lat}
+
+
+class EvacuationTree:
+    """
+    Shortest-path forest towards a set of targets: for every node, the distance to its
+    nearest target, the target itself and the next hop on the way there.
+    """
+
+    def __init__(self, distances, next_hop, nearest):
+        self.distances = distances
+        self.next_hop = next_hop
+        self.nearest = nearest
+
+    def route(self, node):
+        """Node indices from `node` to its nearest target in O(path length), or None if none is reachable."""
+        if not np.isfinite(self.distances[node]):
+            return None
+        path = [node]
+        while self.next_hop[path[-1]] >= 0:
+            path.append(self.next_hop[path[-1]])
+        return path
+
+
+class RoadNetwork:
+    """Road graph as CSR arrays (possibly memory-mapped) with nearest-node lookup and routing."""
+
+    def __init__(self, arrays, meta=None, path=None):
+        for name in CSR_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta or {}
+        # Cache directory of the converted arrays; derived indexes are stored next to them
+        self.path = path
+        n = len(self.node_ids)
+        self.graph = csr_matrix((self.weights, self.indices, self.indptr), shape=(n, n), copy=False)
+        self._tree = None
+        self._reverse = None
+        self._reverse_arrays = None
+        self._id_order = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def with_weights(self, weights):
+        """
+        The same network with other edge weights (e.g. hazard penalties; np.inf blocks an edge).
+        It has no cache directory, so nothing derived from the new weights is persisted.
+        """
+        arrays = {name: getattr(self, name) for name in CSR_ARRAYS}
+        arrays["weights"] = np.asarray(weights, dtype=float)
+        network = RoadNetwork(arrays, self.meta)
+        # Indexes that depend only on the topology carry over
+        network._tree, network._reverse_arrays, network._id_order = self._tree, self._reverse_arrays, self._id_order
+        return network
+
+    def node_index(self, node_ids):
+        """Indices of OSM node ids (-1 for ids not in the network)."""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.node_ids)
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        position = np.minimum(np.searchsorted(self.node_ids, node_ids, sorter=self._id_order), self.n_nodes - 1)
+        index = self._id_order[position]
+        return np.where(self.node_ids[index] == node_ids, index, -1)
+
+    def reverse_csr(self):
+        """
+        Incoming-edge CSR: (indptr, sources, edges) where `edges` are positions in the forward
+        arrays, so reverse traversals always see the current forward weights.
+        """
+        if self._reverse_arrays is None:
+            path = os.path.join(self.path, "reverse") if self.path else None
+            names = ["indptr", "sources", "edges"]
+            if path and os.path.exists(os.path.join(path, "edges.npy")):
+                self._reverse_arrays = tuple(np.load(os.path.join(path, f"{name}.npy")) for name in names)
+            else:
+                edges = np.argsort(self.indices, kind="stable")
+                sources = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))[edges]
+                indptr = np.searchsorted(np.asarray(self.indices)[edges], np.arange(self.n_nodes + 1))
+                self._reverse_arrays = (indptr, sources, edges)
+                if path:
+                    os.makedirs(path, exist_ok=True)
+                    for name, array in zip(names, self._reverse_arrays):
+                        np.save(os.path.join(path, f"{name}.npy"), array)
+        return self._reverse_arrays
+
+    def nearest_nodes(self, lon, lat):
+        """Index of the closest node for arrays of coordinates (KD-tree on the unit sphere)."""
+        if self._tree is None:
+            self._tree = cKDTree(_unit_vectors(self.lon, self.lat))
+        _, nodes = self._tree.query(_unit_vectors(np.atleast_1d(lon), np.atleast_1d(lat)))
+        return nodes
+
+    def shortest_paths(self, sources):
+        """(distances, predecessors) from every source, one row per source."""
+        return dijkstra(self.graph, directed=True, indices=sources, return_predecessors=True)
+
+    def evacuation_tree(self, targets):
+        """
+        One multi-source Dijkstra from all `targets` over the reversed graph, equivalent to a
+        single search from a virtual super-sink joined to every target at zero cost.
+        """
+        if self._reverse is None:
+            self._reverse = self.graph.T.tocsr()
+        distances, predecessors, nearest = dijkstra(self._reverse, directed=True, indices=np.unique(targets),
+                                                    min_only=True, return_predecessors=True)
+        # A predecessor in the reversed graph is the next hop towards the target
+        return EvacuationTree(distances, predecessors, nearest)
+
+    def route(self, source, target, predecessors=None):
+        """Node indices from `source` to `target`, or None if unreachable."""
+        if predecessors is None:
+            _, predecessors = self.shortest_paths(source)
+        path = [target]
+        while path[-1] != source:
+            previous = predecessors[path[-1]]
+            if previous < 0:
+                return None
+            path.append(previous)
+        return path[::-1]
+
+    def coordinates(self, path):
+        path = np.asarray(path)
+        return list(zip(self.lon[path].tolist(), self.lat[path].tolist()))
+
+
+def _cache_key(path, weight):
+    stat = os.stat(path)
+    source = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{weight}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+
+def load_road_network(path, cache_dir=ROAD_CACHE_DIR, weight=ROAD_WEIGHT):
+    """
+    Load a road network, converting it to CSR arrays once.
+
+    The arrays are cached as .npy files under `cache_dir`, keyed by the source file's
+    path, mtime, size and the edge weight; later runs memory-map them instead of
+    parsing the extract with osmnx/networkx.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Road network {path} not found")
+    base = os.path.basename(path).split(".")[0]
+    target = os.path.join(cache_dir, f"{base}-{_cache_key(path, weight)}")
+    meta_path = os.path.join(target, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(target, f"{name}.npy"), mmap_mode="r") for name in CSR_ARRAYS}
+        print(f"✅ Road network from cache {target}: {meta['n_nodes']} nodes, {meta['n_edges']} edges")
+        return RoadNetwork(arrays, meta, target)
+
+    print(f"Converting road network {path} (first run only)...")
+    arrays = graph_to_arrays(read_graph(path), weight)
+    meta = {"source": os.path.abspath(path), "weight": weight,
+            "n_nodes": int(len(arrays["node_ids"])), "n_edges": int(len(arrays["indices"]))}
+    tmp_dir = f"{target}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in CSR_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.replace(tmp_dir, target)
+    except OSError:
+        # Another process cached the same extract first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"✅ Road network cached to {target}: {meta['n_nodes']} nodes, {meta['n_edges']} edges")
+    return RoadNetwork(arrays, meta, target)
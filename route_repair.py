@@ -0,0 +1,220 @@
+import heapq
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+REPAIR_DIR = "evacuation"
+# scipy's predecessor value for search roots and unreachable nodes
+NO_HOP = -9999
+
+
+class RouteRepair:
+    """
+    Persisted nearest-safe-zone shortest-path tree over a RoadNetwork, repaired in place
+    when edge weights change.
+
+    The state (current edge weights, distance to the nearest zone, next hop and nearest
+    zone per node) lives in memory-mapped .npy files. Next to it are the edge weight
+    overrides set by `apply` (NaN where the base weight holds) and the hazard factors
+    set by `apply_hazards`; the current weight of an edge is always its override, or
+    else its base weight, times its hazard factor. Repairs only touch the subtrees
+    hanging off edges that got worse and the nodes that improve through edges that got
+    better (Ramalingam-Reps style), so its cost follows the size of the change.
+    """
+
+    def __init__(self, network, path, zones, built=False):
+        self.network = network
+        self.path = path
+        self.zones = zones
+        # True when the tree was just computed from the base weights rather than loaded
+        self.built = built
+        self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode="r+")
+        self.distances = np.load(os.path.join(path, "distances.npy"), mmap_mode="r+")
+        self.next_hop = np.load(os.path.join(path, "next_hop.npy"), mmap_mode="r+")
+        self.nearest = np.load(os.path.join(path, "nearest.npy"), mmap_mode="r+")
+        self.override = self._state_array("override", np.nan)
+        self.hazard = self._state_array("hazard", 1.0)
+
+    def _state_array(self, name, fill):
+        # Per-edge state that trees saved before it existed do not have yet
+        file_path = os.path.join(self.path, f"{name}.npy")
+        if not os.path.exists(file_path):
+            np.save(file_path, np.full(self.network.n_edges, fill))
+        return np.load(file_path, mmap_mode="r+")
+
+    @classmethod
+    def open(cls, network, zone_nodes, zone_ids, path=None):
+        """Load the persisted state for these safe zones, or build it with one full multi-source search."""
+        path = path or os.path.join(network.path or ".", REPAIR_DIR)
+        # First safe zone snapped to each road node
+        zones = {int(node): zone_id for node, zone_id in zip(zone_nodes[::-1], list(zone_ids)[::-1])}
+        zones_path = os.path.join(path, "zones.json")
+        if os.path.exists(zones_path):
+            with open(zones_path, encoding="utf-8") as f:
+                saved = {int(node): zone_id for node, zone_id in json.load(f).items()}
+            if saved == zones:
+                return cls(network, path, zones)
+            print("Safe zones changed, rebuilding the evacuation tree")
+        tree = network.evacuation_tree(np.array(list(zones)))
+        os.makedirs(path, exist_ok=True)
+        arrays = {"weights": np.asarray(network.weights, dtype=float), "distances": tree.distances,
+                  "next_hop": tree.next_hop.astype(np.int64), "nearest": tree.nearest.astype(np.int64),
+                  "override": np.full(network.n_edges, np.nan), "hazard": np.ones(network.n_edges)}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(zones_path, "w", encoding="utf-8") as f:
+            json.dump({str(node): zone_id for node, zone_id in zones.items()}, f)
+        print(f"✅ Evacuation tree for {len(zones)} safe zones saved to {path}")
+        return cls(network, path, zones, built=True)
+
+    def edge_positions(self, u, v):
+        """Forward CSR positions of edges u -> v (node indices); -1 where there is no such edge."""
+        indptr, indices = self.network.indptr, self.network.indices
+        positions = []
+        for a, b in zip(np.asarray(u).tolist(), np.asarray(v).tolist()):
+            if a < 0 or b < 0:
+                positions.append(-1)
+                continue
+            row = np.flatnonzero(indices[indptr[a]:indptr[a + 1]] == b)
+            positions.append(int(indptr[a] + row[0]) if len(row) else -1)
+        return np.array(positions, dtype=np.int64)
+
+    def apply(self, positions, new_weights):
+        """
+        Override the weights of edges (np.inf blocks an edge) and repair the tree. Active
+        hazard factors still apply on top of the new weights.
+
+        Returns:
+            {node: (old distance, old next hop)} for every node whose route or distance changed
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        self.override[positions] = new_weights
+        self.override.flush()
+        return self._repair(positions, self._effective(positions))
+
+    def apply_hazards(self, factor):
+        """
+        Set the hazard factors (from HazardIndex.penalties) and repair the tree for the
+        edges whose factor changed since the last call, as `apply` does.
+        """
+        positions = np.flatnonzero(factor != self.hazard)
+        self.hazard[positions] = factor[positions]
+        self.hazard.flush()
+        return self._repair(positions, self._effective(positions))
+
+    def _effective(self, positions):
+        # Override, else base weight, times the hazard factor; an infinite factor blocks even 0-weight edges
+        override = self.override[positions]
+        weight = np.where(np.isnan(override), np.asarray(self.network.weights, dtype=float)[positions], override)
+        factor = self.hazard[positions]
+        return np.where(np.isinf(factor), np.inf, weight * factor)
+
+    def _repair(self, positions, new_weights):
+        # Set the current weights of edges and repair the tree; same return value as `apply`
+        indptr, indices = self.network.indptr, self.network.indices
+        reverse_indptr, reverse_sources, reverse_edges = self.network.reverse_csr()
+        weights, distances, next_hop, nearest = self.weights, self.distances, self.next_hop, self.nearest
+        touched = {}
+
+        def settle(node, distance, hop):
+            touched.setdefault(node, (float(distances[node]), int(next_hop[node])))
+            distances[node] = distance
+            next_hop[node] = hop
+            nearest[node] = nearest[hop] if hop >= 0 else NO_HOP
+
+        worse, better = [], []
+        for position, weight in zip(np.asarray(positions).tolist(), np.asarray(new_weights, dtype=float).tolist()):
+            old = float(weights[position])
+            weights[position] = weight
+            u = int(np.searchsorted(indptr, position, side="right") - 1)
+            if weight > old and next_hop[u] == indices[position]:
+                worse.append(u)
+            elif weight < old:
+                better.append((u, position))
+
+        # Every node whose tree path runs through a worsened tree edge loses its route
+        affected = set()
+        stack = worse
+        while stack:
+            x = stack.pop()
+            if x in affected:
+                continue
+            affected.add(x)
+            for k in range(reverse_indptr[x], reverse_indptr[x + 1]):
+                y = int(reverse_sources[k])
+                if next_hop[y] == x and y not in affected:
+                    stack.append(y)
+        for x in affected:
+            settle(x, np.inf, NO_HOP)
+        heap = []
+        for x in affected:
+            # Best way out of the affected region, through nodes whose routes still hold
+            best, hop = np.inf, NO_HOP
+            for k in range(indptr[x], indptr[x + 1]):
+                v = int(indices[k])
+                if v not in affected and weights[k] + distances[v] < best:
+                    best, hop = weights[k] + distances[v], v
+            if hop >= 0:
+                settle(x, best, hop)
+                heapq.heappush(heap, (best, x))
+        for u, position in better:
+            v = int(indices[position])
+            if weights[position] + distances[v] < distances[u]:
+                settle(u, weights[position] + distances[v], v)
+                heapq.heappush(heap, (float(distances[u]), u))
+
+        # Propagate new distances upstream (Dijkstra over incoming edges)
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d > distances[x]:
+                continue
+            for k in range(reverse_indptr[x], reverse_indptr[x + 1]):
+                y = int(reverse_sources[k])
+                candidate = d + weights[reverse_edges[k]]
+                if candidate < distances[y]:
+                    settle(y, candidate, x)
+                    heapq.heappush(heap, (candidate, y))
+        for array in (weights, distances, next_hop, nearest):
+            array.flush()
+        return {x: old for x, old in touched.items() if old != (float(distances[x]), int(next_hop[x]))}
+
+    def _current(self, node):
+        return float(self.distances[node]), int(self.next_hop[node])
+
+    def route(self, node, state=None):
+        """
+        Node indices from `node` to its nearest safe zone, or None if none is reachable;
+        `state(node)` gives (distance, next hop) and defaults to the current tree.
+        """
+        state = state or self._current
+        distance, hop = state(node)
+        if not np.isfinite(distance):
+            return None
+        path = [int(node)]
+        while hop >= 0:
+            path.append(hop)
+            _, hop = state(hop)
+        return path
+
+    def changed_sources(self, sources, changed):
+        """Positions in `sources` whose route or distance differs before and after `changed` (from `apply`)."""
+        previous = lambda node: changed.get(node) or self._current(node)
+        return [i for i, source in enumerate(np.asarray(sources).tolist())
+                if source in changed or self.route(source) != self.route(source, previous)]
+
+
+def read_weight_updates(file_path, network):
+    """
+    Read a CSV of edge weight changes with columns u, v (OSM node ids) and weight;
+    a weight of inf (or an empty weight) blocks the edge.
+
+    Returns:
+        (u, v, weight) arrays of node indices and new weights
+    """
+    updates = pd.read_csv(file_path)
+    weight = pd.to_numeric(updates['weight'], errors='coerce').fillna(np.inf).to_numpy(dtype=float)
+    u = network.node_index(updates['u'].to_numpy())
+    v = network.node_index(updates['v'].to_numpy())
+    return u, v, weight
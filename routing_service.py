@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import networkx as nx
+import geopandas as gpd
+from shapely.geometry import LineString, mapping
+from optimize_routes import (SAFE_ZONE_CANDIDATES, build_dynamic_graph, load_clustered_data, load_safe_zones,
+                             risk_multiplier)
+from road_network import ROAD_CACHE_DIR, ROAD_WEIGHT, load_road_network
+from route_repair import RouteRepair
+from hazard_zones import HazardIndex, hazard_weight, penalize_graph, prepare_hazards
+
+
+ROUTING_SERVICE_HOST = os.getenv("ROUTING_SERVICE_HOST", "127.0.0.1")
+ROUTING_SERVICE_PORT = int(os.getenv("ROUTING_SERVICE_PORT", 8765))
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", 1024))
+# Evacuation tree state of the service, kept apart from optimize_routes.py --repair (route_repair.REPAIR_DIR)
+SERVICE_STATE_DIR = "routing_service"
+
+
+class RouteCache:
+    """
+    Thread-safe LRU cache of serialized responses. Keys carry the routing state version,
+    so a weight update invalidates every cached route at once.
+    """
+
+    def __init__(self, max_entries=ROUTE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RoutingService:
+    """
+    Evacuation routes kept in memory between requests.
+
+    With a road network, routes are walks along the nearest-zone tree of RouteRepair and
+    weight updates repair that tree incrementally; otherwise the straight-line graph of
+    build_dynamic_graph is kept and its nearest-zone search is rerun after risk updates.
+    All routing state is read and written under one lock. The road tree lives in
+    `state_dir` (default `<road cache>/routing_service`), so weight and hazard updates
+    posted to the service never touch the tree of optimize_routes.py --repair.
+    """
+
+    def __init__(self, clustered_file='clustered_risk_zones.csv', safe_zones_file='safe_zones.geojson',
+                 road_network=None, road_cache_dir=ROAD_CACHE_DIR, road_weight=ROAD_WEIGHT,
+                 candidates=SAFE_ZONE_CANDIDATES, cache_size=ROUTE_CACHE_SIZE, state_dir=None):
+        self.clustered_file = clustered_file
+        self.safe_zones_file = safe_zones_file
+        self.network = load_road_network(road_network, road_cache_dir, road_weight) if road_network else None
+        self.candidates = candidates
+        if self.network is not None:
+            state_dir = state_dir or os.path.join(self.network.path or ".", SERVICE_STATE_DIR)
+        self.state_dir = state_dir
+        self.cache = RouteCache(cache_size)
+        self.counters = {"requests": 0, "updates": 0, "hazard_updates": 0, "reloads": 0}
+        self._hazard_index = None
+        self.version = 0
+        self.started = time.time()
+        self._lock = threading.RLock()
+        self.reload()
+
+    @property
+    def mode(self):
+        return "road" if self.network is not None else "graph"
+
+    def reload(self):
+        """Re-read the clustered cities and safe zones (after a pipeline run) and rebuild the routing state."""
+        df = load_clustered_data(self.clustered_file)
+        safe_zones = load_safe_zones(self.safe_zones_file)
+        if safe_zones is None or safe_zones.empty:
+            raise RuntimeError("No safe zones! Run cluster_risk_zones.py first.")
+        with self._lock:
+            self.df = df.drop_duplicates('city', keep='last').reset_index(drop=True)
+            self.safe_zones = safe_zones
+            self.city_rows = dict(zip(self.df['city'], range(len(self.df))))
+            self.zone_rows = dict(zip(safe_zones['safe_zone_id'], range(len(safe_zones))))
+            if self.network is not None:
+                zone_nodes = self.network.nearest_nodes(safe_zones['longitude'].to_numpy(),
+                                                        safe_zones['latitude'].to_numpy())
+                self.repair = RouteRepair.open(self.network, zone_nodes, safe_zones['safe_zone_id'].tolist(),
+                                               self.state_dir)
+                self.sources = self.network.nearest_nodes(self.df['longitude'].to_numpy(),
+                                                          self.df['latitude'].to_numpy())
+            else:
+                self.graph = build_dynamic_graph(self.df, safe_zones, self.candidates)
+                self._tree = None
+            self.version += 1
+            self.counters["reloads"] += 1
+
+    def _graph_tree(self):
+        if self._tree is None:
+            zones = [node for node, kind in self.graph.nodes(data='type') if kind == 'safe_zone']
+            self._tree = nx.multi_source_dijkstra(self.graph.reverse(copy=False), zones, weight='weight')
+        return self._tree
+
+    def _feature(self, city, start, path, zone_id, cost):
+        zone = self.safe_zones.iloc[self.zone_rows[zone_id]]
+        coords = [start] + path + [(zone['longitude'], zone['latitude'])]
+        return {"type": "Feature", "geometry": mapping(LineString(coords)),
+                "properties": {"city": city, "safe_zone_id": zone_id, "cost": float(cost)}}
+
+    def _road_route(self, city, start, source):
+        path = self.repair.route(source)
+        if path is None:
+            return None
+        return self._feature(city, start, self.network.coordinates(path), self.repair.zones[path[-1]],
+                             self.repair.distances[source])
+
+    def route(self, city=None, lon=None, lat=None):
+        """GeoJSON Feature of the route from a city (or, with a road network, any point) to its nearest safe zone."""
+        with self._lock:
+            if city is not None:
+                if city not in self.city_rows:
+                    raise KeyError(f"Unknown city: {city}")
+                row = self.df.iloc[self.city_rows[city]]
+                start = (row['longitude'], row['latitude'])
+                if self.network is not None:
+                    return self._road_route(city, start, self.sources[self.city_rows[city]])
+                distances, paths = self._graph_tree()
+                if city not in paths:
+                    return None
+                path = paths[city][::-1]
+                return self._feature(city, start, [], path[-1], distances[city])
+            if self.network is None:
+                raise ValueError("Routes from coordinates need a road network")
+            source = self.network.nearest_nodes(lon, lat)[0]
+            return self._road_route(None, (lon, lat), source)
+
+    def routes(self):
+        """FeatureCollection with the route of every city that can reach a safe zone."""
+        with self._lock:
+            features = [self.route(city=city) for city in self.df['city']]
+        return {"type": "FeatureCollection", "features": [f for f in features if f is not None],
+                "version": self.version}
+
+    def update_weights(self, updates):
+        """
+        Apply weight updates and return the cities whose route changed.
+
+        Road mode takes [{"u": osm_id, "v": osm_id, "weight": w}] (null or "inf" blocks the
+        edge); graph mode takes [{"city": name, "risk_score": r}].
+        """
+        with self._lock:
+            if self.network is not None:
+                u = self.network.node_index([item["u"] for item in updates])
+                v = self.network.node_index([item["v"] for item in updates])
+                weights = np.array([np.inf if item.get("weight") is None else float(item["weight"])
+                                    for item in updates])
+                positions = self.repair.edge_positions(u, v)
+                if (positions < 0).any():
+                    raise KeyError(f"{int((positions < 0).sum())} updates are for edges not in the road network")
+                changed = self.repair.apply(positions, weights)
+                rows = self.repair.changed_sources(self.sources, changed)
+                cities = self.df['city'].iloc[rows].tolist()
+            else:
+                cities = []
+                for item in updates:
+                    city, risk = item["city"], float(item["risk_score"])
+                    if city not in self.graph:
+                        raise KeyError(f"Unknown city: {city}")
+                    self.graph.nodes[city]['risk'] = risk
+                    for _, _, data in self.graph.out_edges(city, data=True):
+                        data['base_weight'] = data['distance_km'] * float(risk_multiplier(risk))
+                        data['weight'] = hazard_weight(data['base_weight'], data.get('hazard', 1.0))
+                    cities.append(city)
+                self._tree = None
+            self.version += 1
+            self.counters["updates"] += 1
+            return {"version": self.version, "changed": cities}
+
+    def update_hazards(self, features):
+        """
+        Replace the active hazard polygons (GeoJSON features, optional `penalty` property)
+        and return the cities whose route changed.
+        """
+        hazards = prepare_hazards(gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")) if features else \
+            gpd.GeoDataFrame({'penalty': []}, geometry=gpd.GeoSeries([]), crs="EPSG:4326")
+        with self._lock:
+            if self.network is not None:
+                if self._hazard_index is None:
+                    self._hazard_index = HazardIndex.for_network(self.network)
+                changed = self.repair.apply_hazards(self._hazard_index.penalties(hazards))
+                rows = self.repair.changed_sources(self.sources, changed)
+                cities = self.df['city'].iloc[rows].tolist()
+            else:
+                before = self.routes()["features"]
+                penalize_graph(self.graph, hazards)
+                self._tree = None
+                after = {f["properties"]["city"]: f for f in self.routes()["features"]}
+                cities = [f["properties"]["city"] for f in before if after.get(f["properties"]["city"]) != f]
+                cities += [city for city in after if city not in {f["properties"]["city"] for f in before}]
+            self.version += 1
+            self.counters["hazard_updates"] += 1
+            return {"version": self.version, "changed": cities}
+
+    def stats(self):
+        return {"mode": self.mode, "version": self.version, "cities": len(self.df),
+                "safe_zones": len(self.safe_zones), "uptime_s": round(time.time() - self.started, 1),
+                "cache": {**self.cache.counters, "entries": len(self.cache)}, **self.counters}
+
+
+class RoutingHandler(BaseHTTPRequestHandler):
+    """JSON API: GET /route, /routes, /health, /stats; POST /weights, /hazards, /reload."""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        service.counters["requests"] += 1
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            return self._send(200, {"status": "ok", "version": service.version})
+        if url.path == "/stats":
+            return self._send(200, service.stats())
+        if url.path not in ("/route", "/routes"):
+            return self._send(404, {"error": f"Unknown endpoint {url.path}"})
+        key = (service.version, url.path, tuple(sorted(query.items())))
+        body = service.cache.get(key)
+        if body is None:
+            try:
+                if url.path == "/routes":
+                    result = service.routes()
+                elif "city" in query:
+                    result = service.route(city=query["city"])
+                else:
+                    result = service.route(lon=float(query["lon"]), lat=float(query["lat"]))
+            except KeyError as e:
+                return self._send(404 if "city" in query else 400, {"error": str(e).strip("'")})
+            except ValueError as e:
+                return self._send(400, {"error": str(e)})
+            if result is None:
+                return self._send(404, {"error": "No safe zone reachable"})
+            body = json.dumps(result).encode("utf-8")
+            service.cache.put(key, body)
+        self._send(200, body)
+
+    def do_POST(self):
+        service = self.server.service
+        service.counters["requests"] += 1
+        url = urlsplit(self.path)
+        try:
+            if url.path == "/weights":
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                return self._send(200, service.update_weights(payload.get("updates", [])))
+            if url.path == "/hazards":
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                return self._send(200, service.update_hazards(payload.get("features", [])))
+            if url.path == "/reload":
+                service.reload()
+                return self._send(200, {"version": service.version})
+        except (KeyError, ValueError, TypeError) as e:
+            return self._send(400, {"error": str(e).strip("'")})
+        except (OSError, RuntimeError) as e:
+            return self._send(500, {"error": str(e)})
+        self._send(404, {"error": f"Unknown endpoint {url.path}"})
+
+
+def serve(service, host=ROUTING_SERVICE_HOST, port=ROUTING_SERVICE_PORT, verbose=False):
+    server = ThreadingHTTPServer((host, port), RoutingHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    print(f"✅ Routing service ({service.mode} mode) on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Resident evacuation routing service (local HTTP JSON API)")
+    parser.add_argument("--host", default=ROUTING_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=ROUTING_SERVICE_PORT)
+    parser.add_argument("--input", default="clustered_risk_zones.csv")
+    parser.add_argument("--safe-zones", default="safe_zones.geojson")
+    parser.add_argument("--road-network", help="Local road network (.graphml, .osm or .osm.pbf)")
+    parser.add_argument("--road-cache-dir", default=ROAD_CACHE_DIR)
+    parser.add_argument("--road-weight", default=ROAD_WEIGHT)
+    parser.add_argument("--candidates", type=int, default=SAFE_ZONE_CANDIDATES)
+    parser.add_argument("--cache-size", type=int, default=ROUTE_CACHE_SIZE)
+    parser.add_argument("--state-dir", help="Directory for the service's evacuation tree "
+                                            "(default: <road cache>/routing_service)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        service = RoutingService(args.input, args.safe_zones, args.road_network, args.road_cache_dir,
+                                 args.road_weight, args.candidates, args.cache_size, args.state_dir)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"❌ Could not start routing service: {e}")
+        return
+    serve(service, args.host, args.port, args.verbose)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import json
+import os
+from datetime import datetime
+import numpy as np
+
+
+STATS_DIR = os.getenv("STATS_DIR", "stats")
+# 1.0 keeps the full history; < 1.0 scales the accumulated weight down on every update
+STATS_DECAY = float(os.getenv("STATS_DECAY", 1.0))
+
+
+class RunningStats:
+    """
+    Persistent per-feature running mean/variance.
+
+    Batches are merged with Welford's update (Chan et al. for whole batches), so memory is
+    O(1) per feature and updating costs O(1) per row. With `decay` < 1 the accumulated
+    history is down-weighted by that factor on every update (exponential forgetting).
+    """
+
+    def __init__(self, path=None, decay=STATS_DECAY):
+        self.path = path
+        self.decay = decay
+        self.features = {}
+        # Fetch time (ISO) of the newest batch folded in, when the caller records it
+        self.refreshed_at = None
+
+    @classmethod
+    def load(cls, path, decay=STATS_DECAY):
+        store = cls(path, decay)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            store.features = data.get("features", {})
+            store.refreshed_at = data.get("refreshed_at")
+        return store
+
+    def save(self, path=None):
+        path = path or self.path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"decay": self.decay, "features": self.features, "refreshed_at": self.refreshed_at}, f,
+                      indent=2)
+        os.replace(tmp_path, path)
+
+    def update(self, df, features):
+        for feature in features:
+            values = df[feature].dropna().to_numpy(dtype=float)
+            if values.size == 0:
+                continue
+            state = self.features.get(feature, {"weight": 0.0, "mean": 0.0, "m2": 0.0})
+            weight_a = state["weight"] * self.decay
+            m2_a = state["m2"] * self.decay
+            weight_b = float(values.size)
+            mean_b = float(values.mean())
+            m2_b = float(((values - mean_b) ** 2).sum())
+            weight = weight_a + weight_b
+            delta = mean_b - state["mean"]
+            self.features[feature] = {
+                "weight": weight,
+                "mean": state["mean"] + delta * weight_b / weight,
+                "m2": m2_a + m2_b + delta ** 2 * weight_a * weight_b / weight,
+            }
+        return self
+
+    def seen(self, refreshed_at):
+        """True if a batch fetched at `refreshed_at` (ISO) is no newer than the newest one recorded."""
+        if refreshed_at is None or self.refreshed_at is None:
+            return False
+        return datetime.fromisoformat(refreshed_at) <= datetime.fromisoformat(self.refreshed_at)
+
+    def update_chunks(self, chunks, features):
+        """Stream an iterable of DataFrames (e.g. pd.read_csv(..., chunksize=...)) through the store."""
+        for chunk in chunks:
+            self.update(chunk, features)
+        return self
+
+    def mean(self, feature):
+        return self.features[feature]["mean"]
+
+    def std(self, feature):
+        state = self.features[feature]
+        return float(np.sqrt(state["m2"] / state["weight"])) if state["weight"] > 0 else 0.0
+
+    def normalize(self, df, features):
+        """z-score `features` of `df` with the stored statistics; returns an (n, k) array."""
+        means = np.array([self.mean(f) for f in features])
+        stds = np.array([self.std(f) for f in features])
+        stds[stds == 0] = 1.0
+        return (df[features].to_numpy(dtype=float) - means) / stds
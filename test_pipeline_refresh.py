@@ -0,0 +1,52 @@
+import os
+import time
+from pipeline_refresh import PipelineRefresher, SNAPSHOT_FILES
+
+
+def _stage(tmp_path, name, outputs):
+    # A pipeline stage that rewrites `outputs` and exits 0
+    script = tmp_path / name
+    script.write_text("import sys\nfor name in sys.argv[1:]:\n    open(name, 'w').write('{}')\n")
+    return [str(script)] + outputs
+
+
+def _leftovers(tmp_path):
+    # Outputs of an earlier run, two days old
+    old = time.time() - 2 * 86400
+    for name in ["preprocessed_weather_data.csv"] + SNAPSHOT_FILES:
+        (tmp_path / name).write_text("{}")
+        os.utime(tmp_path / name, (old, old))
+
+
+def test_refresh_fails_when_fetch_writes_nothing(tmp_path):
+    _leftovers(tmp_path)
+    stages = [_stage(tmp_path, "fetch.py", []),
+              _stage(tmp_path, "cluster.py", ["clustered_risk_zones.geojson", "safe_zones.geojson"]),
+              _stage(tmp_path, "route.py", ["dynamic_evacuation_routes.geojson"])]
+    refresher = PipelineRefresher(work_dir=str(tmp_path), stages=stages)
+    assert refresher.trigger()
+    refresher.wait()
+    assert "preprocessed_weather_data.csv" in refresher.status()["last_error"]
+    assert refresher.current() is None
+
+
+def test_refresh_publishes_layers_written_by_the_run(tmp_path):
+    _leftovers(tmp_path)
+    stages = [_stage(tmp_path, "fetch.py", ["preprocessed_weather_data.csv"]),
+              _stage(tmp_path, "cluster.py", ["clustered_risk_zones.geojson", "safe_zones.geojson"]),
+              _stage(tmp_path, "route.py", ["dynamic_evacuation_routes.geojson"])]
+    refresher = PipelineRefresher(work_dir=str(tmp_path), stages=stages)
+    assert refresher.trigger()
+    refresher.wait()
+    assert refresher.status()["last_error"] is None
+    assert sorted(os.listdir(refresher.current())) == sorted(SNAPSHOT_FILES + ["meta.json"])
+
+
+def test_refresh_fails_when_a_stage_exits_non_zero(tmp_path):
+    script = tmp_path / "fetch.py"
+    script.write_text("import sys\nprint('No data to save.')\nsys.exit(1)\n")
+    refresher = PipelineRefresher(work_dir=str(tmp_path), stages=[[str(script)]])
+    refresher.trigger()
+    refresher.wait()
+    assert "fetch.py exited with 1" in refresher.status()["last_error"]
+    assert refresher.current() is None
@@ -0,0 +1,42 @@
+import glob
+import gzip
+import json
+import os
+from datetime import datetime
+
+
+ARCHIVE_DIR = os.getenv("WEATHER_ARCHIVE_DIR", "archive")
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def write_archive(entries, archive_dir=ARCHIVE_DIR, refreshed_at=None, alert_feed=None):
+    """
+    Write the raw responses of one refresh to `archive_dir/weather-<UTC time>.jsonl.gz`.
+
+    The first line is a header with the refresh time and, in bulk alert mode, the raw
+    GDACS feed; every following line is one {"city", "weather", "alerts"} entry.
+    """
+    refreshed_at = refreshed_at or datetime.utcnow()
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"weather-{refreshed_at.strftime(TIMESTAMP_FORMAT)}.jsonl.gz")
+    header = {"refreshed_at": refreshed_at.isoformat(), "alert_feed": alert_feed}
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    print(f"Archived {len(entries)} raw responses to {path}")
+    return path
+
+
+def read_archive(path):
+    """Return (header, entries) for an archive written by write_archive."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        entries = [json.loads(line) for line in f if line.strip()]
+    header["refreshed_at"] = datetime.fromisoformat(header["refreshed_at"])
+    return header, entries
+
+
+def latest_archive(archive_dir=ARCHIVE_DIR):
+    paths = sorted(glob.glob(os.path.join(archive_dir, "weather-*.jsonl.gz")))
+    return paths[-1] if paths else None
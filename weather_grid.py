@@ -0,0 +1,139 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS_KM = 6371.0088
+GRID_DISTANCE_KM = float(os.getenv("GRID_DISTANCE_KM", 20))
+# Precision 5 cells are about 4.9 km x 4.9 km
+GRID_PRECISION = int(os.getenv("GRID_GEOHASH_PRECISION", 5))
+# Cell observations are reused from the response cache for this many seconds
+GRID_CACHE_TTL = int(os.getenv("GRID_CACHE_TTL", 1800))
+
+# Compass directions sampled around each city (bearing in degrees from north)
+DIRECTIONS = [
+    ("North", 0.0), ("NorthEast", 45.0), ("East", 90.0), ("SouthEast", 135.0),
+    ("South", 180.0), ("SouthWest", 225.0), ("West", 270.0), ("NorthWest", 315.0),
+]
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def compass_directions(n_directions=8):
+    """`n_directions` evenly spaced (name, bearing) pairs, named by compass point where possible."""
+    names = dict((bearing, name) for name, bearing in DIRECTIONS)
+    bearings = np.arange(n_directions) * 360.0 / n_directions
+    return [(names.get(float(b), f"Bearing {b:g}"), float(b)) for b in bearings]
+
+
+def destination_points(lat, lon, bearing_deg, distance_km):
+    """Great-circle destination for arrays of start points, bearings and distances (broadcast)."""
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    bearing = np.radians(bearing_deg)
+    angular = np.asarray(distance_km, dtype=float) / EARTH_RADIUS_KM
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angular) + np.cos(lat1) * np.sin(angular) * np.cos(bearing))
+    lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(angular) * np.cos(lat1),
+                             np.cos(angular) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lon2) + 540.0) % 360.0 - 180.0
+
+
+def geohash_encode(lat, lon, precision=GRID_PRECISION):
+    """Vectorized geohash of arrays of coordinates."""
+    lat = np.asarray(lat, dtype=float).ravel()
+    lon = np.asarray(lon, dtype=float).ravel()
+    lat_range = np.array([np.full_like(lat, -90.0), np.full_like(lat, 90.0)])
+    lon_range = np.array([np.full_like(lon, -180.0), np.full_like(lon, 180.0)])
+    codes = np.zeros((lat.size, precision), dtype=np.int64)
+    for bit in range(precision * 5):
+        # Even bits halve the longitude interval, odd bits the latitude interval
+        value, bounds = (lon, lon_range) if bit % 2 == 0 else (lat, lat_range)
+        mid = bounds.mean(axis=0)
+        upper = value >= mid
+        bounds[0] = np.where(upper, mid, bounds[0])
+        bounds[1] = np.where(upper, bounds[1], mid)
+        codes[:, bit // 5] = codes[:, bit // 5] * 2 + upper
+    return ["".join(_BASE32[c] for c in row) for row in codes]
+
+
+def geohash_center(geohash):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    is_lon = True
+    for char in geohash:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if is_lon else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if (bits >> shift) & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            is_lon = not is_lon
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def grid_points(cities, distance_km=GRID_DISTANCE_KM, directions=DIRECTIONS, precision=GRID_PRECISION):
+    """One row per (city, direction) sample point, tagged with its geohash cell."""
+    names = [name for name, _ in directions]
+    bearings = np.array([bearing for _, bearing in directions])
+    lat, lon = destination_points(
+        cities["latitude"].to_numpy()[:, None], cities["longitude"].to_numpy()[:, None],
+        bearings[None, :], distance_km,
+    )
+    points = pd.DataFrame({
+        "city": np.repeat(cities["city"].to_numpy(), len(directions)),
+        "direction": np.tile(names, len(cities)),
+        "bearing_deg": np.tile(bearings, len(cities)),
+        "distance_km": distance_km,
+        "latitude": lat.ravel(),
+        "longitude": lon.ravel(),
+    })
+    points["geohash"] = geohash_encode(points["latitude"], points["longitude"], precision)
+    return points
+
+
+def _cell_observation(weather_json):
+    current = (weather_json or {}).get("current")
+    if not current:
+        return None
+    precipitation = current.get("precip_mm")
+    return {
+        "temperature_c": current.get("temp_c"),
+        "humidity": current.get("humidity", 0) / 100,
+        "pressure_mb": current.get("pressure_mb"),
+        "wind_speed_kph": current.get("wind_kph"),
+        "precipitation_mm": precipitation if precipitation is not None else 0.0,
+    }
+
+
+def sample_grid(cities, fetch, distance_km=GRID_DISTANCE_KM, directions=DIRECTIONS,
+                precision=GRID_PRECISION):
+    """
+    Sample weather on a ring of points around each city, fetching each geohash cell once.
+
+    Args:
+        cities: DataFrame with city, latitude, longitude
+        fetch: Callable taking a list of WeatherAPI queries ("lat,lon") and returning a
+            {query: weather_json} dict
+        distance_km: Ring radius
+        directions: (name, bearing) pairs to sample
+        precision: Geohash precision; points in the same cell share one request
+
+    Returns:
+        DataFrame with one row per (city, direction) and the cell's observed weather
+        (temperature_c is in degrees C, not normalized)
+    """
+    points = grid_points(cities, distance_km, directions, precision)
+    cells = points["geohash"].unique()
+    queries = {cell: "{:.4f},{:.4f}".format(*geohash_center(cell)) for cell in cells}
+    print(f"Grid: {len(points)} sample points share {len(cells)} geohash cells")
+    responses = fetch(list(queries.values()))
+    observations = {}
+    for cell, query in queries.items():
+        observation = _cell_observation(responses.get(query))
+        if observation is not None:
+            observations[cell] = observation
+    if not observations:
+        return points.iloc[0:0]
+    observations = pd.DataFrame.from_dict(observations, orient="index")
+    return points.join(observations, on="geohash", how="inner").reset_index(drop=True)
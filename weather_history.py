@@ -0,0 +1,194 @@
+import json
+import os
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+
+HISTORY_DIR = os.getenv("WEATHER_HISTORY_DIR", "history")
+# Slots kept per city; at one refresh every 10 minutes 512 slots cover ~3.5 days
+HISTORY_CAPACITY = int(os.getenv("WEATHER_HISTORY_CAPACITY", 512))
+HISTORY_FIELDS = ['precipitation_mm', 'pressure_mb', 'wind_speed_kph', 'humidity']
+PRECIP_WINDOWS_H = (6, 24)
+PRESSURE_WINDOW_H = 3
+# precipitation_mm is read as the last hour's amount; a sample never stands for more than this
+MAX_SAMPLE_HOURS = 1.0
+HISTORY_FEATURES = [f"precip_{hours}h_mm" for hours in PRECIP_WINDOWS_H] + ['pressure_drop_rate']
+
+
+def _epoch(timestamp):
+    # Naive datetimes are UTC, as produced by datetime.utcnow()
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class WeatherHistory:
+    """
+    Per-city ring buffer of observations in memory-mapped .npy files.
+
+    `times.npy` (cities x capacity) holds UTC epoch seconds, `values.npy`
+    (cities x capacity x fields) the observations and `heads.npy` the number of
+    refreshes appended per city; `index.json` maps city names to rows. Appending a
+    refresh writes one slot per city, and window queries read only the rows they need.
+    """
+
+    def __init__(self, path=HISTORY_DIR, capacity=HISTORY_CAPACITY):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            self.capacity = index["capacity"]
+            self.fields = index["fields"]
+            self.cities = index["cities"]
+            self.times = np.load(self._file("times"), mmap_mode="r+")
+            self.values = np.load(self._file("values"), mmap_mode="r+")
+            self.heads = np.load(self._file("heads"), mmap_mode="r+")
+        else:
+            self.capacity = capacity
+            self.fields = list(HISTORY_FIELDS)
+            self.cities = {}
+            self._allocate(16)
+            self._save_index()
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _allocate(self, n_rows, old=None):
+        # (Re)create the arrays with room for n_rows cities, copying `old` rows over
+        shapes = {
+            "times": ((n_rows, self.capacity), np.float64, np.nan),
+            "values": ((n_rows, self.capacity, len(self.fields)), np.float64, np.nan),
+            "heads": ((n_rows,), np.int64, 0),
+        }
+        for name, (shape, dtype, fill) in shapes.items():
+            tmp_path = self._file(f"{name}.tmp")
+            array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            array[:] = fill
+            if old is not None:
+                array[:len(old[name])] = old[name]
+            array.flush()
+            del array
+            os.replace(tmp_path, self._file(name))
+        self.times = np.load(self._file("times"), mmap_mode="r+")
+        self.values = np.load(self._file("values"), mmap_mode="r+")
+        self.heads = np.load(self._file("heads"), mmap_mode="r+")
+
+    def _save_index(self):
+        index_path = os.path.join(self.path, "index.json")
+        with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"capacity": self.capacity, "fields": self.fields, "cities": self.cities}, f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def _rows(self, cities, create=False):
+        # Row per city, -1 for unknown cities unless `create` adds them
+        new = [city for city in dict.fromkeys(cities) if city not in self.cities] if create else []
+        if new:
+            for city in new:
+                self.cities[city] = len(self.cities)
+            if len(self.cities) > len(self.heads):
+                # Doubling keeps growth amortized O(1) per city
+                old = {"times": self.times, "values": self.values, "heads": self.heads}
+                self._allocate(max(2 * len(self.heads), len(self.cities)), old)
+            self._save_index()
+        return np.array([self.cities.get(city, -1) for city in cities], dtype=np.int64)
+
+    def append(self, df, refreshed_at=None):
+        """
+        Add one refresh (one row per city) to the store.
+
+        A refresh is keyed by its UTC time: appending the same time again overwrites
+        that slot, and refreshes older than a city's latest one are ignored.
+        """
+        df = df.drop_duplicates('city', keep='last')
+        if df.empty:
+            return 0
+        timestamp = _epoch(refreshed_at or datetime.utcnow())
+        rows = self._rows(df['city'].tolist(), create=True)
+        heads = self.heads[rows]
+        latest = np.where(heads > 0, self.times[rows, (heads - 1) % self.capacity], -np.inf)
+        replace = latest == timestamp
+        write = replace | (latest < timestamp)
+        slots = np.where(replace, heads - 1, heads) % self.capacity
+        self.times[rows[write], slots[write]] = timestamp
+        self.values[rows[write], slots[write]] = df[self.fields].to_numpy(dtype=float)[write]
+        self.heads[rows[write & ~replace]] += 1
+        for array in (self.times, self.values, self.heads):
+            array.flush()
+        print(f"History: appended {int(write.sum())} cities at {datetime.utcfromtimestamp(timestamp).isoformat()}Z")
+        return int(write.sum())
+
+    def window(self, cities):
+        """
+        Chronological ring contents for `cities`.
+
+        Returns:
+            (times, values) with shapes (n, capacity) and (n, capacity, fields), oldest
+            slot first; unused slots and unknown cities are NaN
+        """
+        rows = self._rows(list(cities))
+        known = rows >= 0
+        heads = np.where(known, self.heads[np.maximum(rows, 0)], 0)
+        slots = np.arange(self.capacity)
+        order = (heads[:, None] + slots[None, :]) % self.capacity
+        valid = slots[None, :] >= self.capacity - np.minimum(heads, self.capacity)[:, None]
+        rows = np.maximum(rows, 0)[:, None]
+        times = np.where(valid, self.times[rows, order], np.nan)
+        values = np.where(valid[:, :, None], self.values[rows, order], np.nan)
+        return times, values
+
+    def rolling_features(self, cities, now=None):
+        """
+        Rolling-window features per city, computed over the ring in one vectorized pass.
+
+        Args:
+            cities: City names
+            now: End of the windows (datetime); defaults to the latest stored refresh
+
+        Returns:
+            DataFrame indexed by city with accumulated precipitation per window
+            (precip_6h_mm, precip_24h_mm) and pressure_drop_rate (hPa/h over the last
+            3 h, positive when pressure falls); cities without history get zeros
+        """
+        cities = list(cities)
+        times, values = self.window(cities)
+        if now is not None:
+            now = _epoch(now)
+        elif np.isfinite(times).any():
+            now = np.nanmax(times)
+        else:
+            return pd.DataFrame(0.0, index=pd.Index(cities, name='city'), columns=HISTORY_FEATURES)
+        age_h = (now - times) / 3600.0
+        # Each sample stands for the time since the previous one (a full hour for the oldest)
+        previous = np.concatenate([np.full((len(cities), 1), np.nan), times[:, :-1]], axis=1)
+        gap_h = np.nan_to_num((times - previous) / 3600.0, nan=MAX_SAMPLE_HOURS)
+        covered_h = np.clip(gap_h, 0, MAX_SAMPLE_HOURS)
+        precipitation = np.nan_to_num(values[:, :, self.fields.index('precipitation_mm')])
+        features = {}
+        for hours in PRECIP_WINDOWS_H:
+            in_window = (age_h >= 0) & (age_h < hours)
+            features[f"precip_{hours}h_mm"] = np.where(in_window, precipitation * covered_h, 0.0).sum(axis=1)
+        # Least-squares slope of pressure against time over the pressure window
+        pressure = values[:, :, self.fields.index('pressure_mb')]
+        in_window = (age_h >= 0) & (age_h <= PRESSURE_WINDOW_H) & np.isfinite(pressure)
+        n = in_window.sum(axis=1)
+        t = np.where(in_window, -age_h, 0.0)
+        p = np.where(in_window, pressure, 0.0)
+        t_mean = t.sum(axis=1) / np.maximum(n, 1)
+        p_mean = p.sum(axis=1) / np.maximum(n, 1)
+        covariance = np.where(in_window, (t - t_mean[:, None]) * (p - p_mean[:, None]), 0.0).sum(axis=1)
+        variance = np.where(in_window, (t - t_mean[:, None]) ** 2, 0.0).sum(axis=1)
+        slope = np.divide(covariance, variance, out=np.zeros(len(cities)), where=(n >= 2) & (variance > 0))
+        features['pressure_drop_rate'] = 0.0 - slope
+        return pd.DataFrame(features, index=pd.Index(cities, name='city'))[HISTORY_FEATURES]
+
+
+def add_history_features(df, history, now=None):
+    """Return `df` with the rolling history features of its cities merged in."""
+    features = history.rolling_features(df['city'].unique(), now)
+    df = df.drop(columns=[c for c in HISTORY_FEATURES if c in df]).merge(
+        features, left_on='city', right_index=True, how='left')
+    df[HISTORY_FEATURES] = df[HISTORY_FEATURES].fillna(0.0)
+    return df